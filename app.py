@@ -61,4 +61,4 @@ def render_content(tab: str) -> html.Div | None:
     return None
 
 if __name__ == "__main__":
-    app.run_server(debug=DEBUG_STATE, port=8000)
+    app.run(debug=DEBUG_STATE, port=8000)
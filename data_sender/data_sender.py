@@ -1,17 +1,18 @@
 import dash_bootstrap_components as dbc
-import firebase_admin
+import os
+import sys
 
 from dash import Dash, dcc, html
 from dash.dependencies import Input, Output
 from datetime import datetime, date
-from firebase_admin import db
-from firebase_admin import credentials
 
-# ===== Firebase ===== #
-cred = credentials.Certificate("serviceAccountKey.json")
-firebase_admin = firebase_admin.initialize_app(cred, {"databaseURL": "https://friendly-bazaar-334818-default-rtdb.firebaseio.com"})
+# Makes the shared modules importable when running the script from its folder
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-root_ref = db.reference("/yet_another_test/")
+from modules import storage_backend
+
+# ===== Storage ===== #
+backend = storage_backend.get_backend("/yet_another_test/")
 
 # ===== Data Types ===== #
 data_types = {
@@ -76,9 +77,7 @@ def send_data_callback(n_clicks: int, dataType: str, n_intervals: int) -> str:
         # Send data
         date_ = date.today().strftime("%Y-%m-%d")
         timestamp = str(timestamp).replace(".", "")[:13]
-        root_ref.child(date_).child(timestamp).set(
-            data_types[dataType]
-        )
+        backend.push(date_, timestamp, data_types[dataType])
         return f"Data {n_intervals} sent at {now.strftime('%H:%M:%S')}", "Stop Sending Data", "btn btn-lg btn-danger"
 
 @app.callback(
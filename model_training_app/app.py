@@ -1,8 +1,13 @@
 import dash
 import dash_bootstrap_components as dbc
+import os
+import sys
 
 from dash import html
 
+# Makes the shared modules importable when running the app from its folder
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 external_stylesheets = [
     dbc.themes.BOOTSTRAP,
     "https://fonts.googleapis.com/css2?family=Readex+Pro&display=swap"
@@ -1,14 +1,20 @@
-import firebase_admin
 import polars as pl
 
 from datetime import datetime, timedelta, date
-from firebase_admin import credentials
-from firebase_admin import db
+from threading import Lock
+from typing import Optional
 
-cred = credentials.Certificate("serviceAccountKey.json")
-firebase_admin = firebase_admin.initialize_app(cred, {"databaseURL": "https://friendly-bazaar-334818-default-rtdb.firebaseio.com"})
+from modules import storage_backend
 
-root_ref = db.reference("/yet_another_test/")
+backend = storage_backend.get_backend("/yet_another_test/")
+
+# ===== Current day sync ===== #
+# The data from the current day is kept in memory and only the readings after
+# the last key seen are fetched
+today = ""
+today_data = pl.DataFrame()
+today_last_key: Optional[str] = None
+today_lock = Lock()
 
 def ord_dict_to_df(data: dict) -> pl.DataFrame:
     """
@@ -47,13 +53,49 @@ def get_data_from_day(day: str) -> pl.DataFrame:
     -------
     polars.DataFrame
     """
-    result = root_ref.child(day).get()
+    if day == str(date.today()):
+        return sync_today()
+
+    result = backend.get_day(day)
     if result is None:
         return pl.DataFrame()
     data = ord_dict_to_df(result)
 
     return data
 
+def sync_today() -> pl.DataFrame:
+    """
+    Brings the data from the current day up to date, fetching only the readings
+    after the last key seen.
+
+    Returns
+    -------
+    polars.DataFrame
+        The data from the current day.
+    """
+    global today, today_data, today_last_key
+
+    with today_lock:
+        day = str(date.today())
+        if day != today:
+            today = day
+            today_data = pl.DataFrame()
+            today_last_key = None
+
+        result = backend.get_tail(day, start_after=today_last_key)
+        if len(result) > 0:
+            new_data = ord_dict_to_df(result)
+            today_last_key = max(result.keys())
+            if today_data.shape[0] == 0:
+                today_data = new_data
+            else:
+                today_data = pl.concat([today_data, new_data], rechunk=False)
+                # Merge the small chunks of each update from time to time
+                if today_data.n_chunks() > 32:
+                    today_data = today_data.rechunk()
+
+        return today_data
+
 def get_current_data() -> pl.DataFrame:
     """
     Gets the data currently being sent by the sensors.
@@ -64,10 +106,10 @@ def get_current_data() -> pl.DataFrame:
     polars.DataFrame
         A one-row DataFrame.
     """
-    today_data = get_data_from_day(str(date.today()))
+    today_data = sync_today()
     if today_data.shape[0] == 0:
         return today_data
-    today_data = today_data.sort("index", descending=True)
+    today_data = today_data.tail(1)
     current_time = datetime.now()
     # The sensors take around 500ms to send the data, so 2 seconds is a safe threshold
     threshold = timedelta(seconds=1)
@@ -85,7 +127,7 @@ def get_list_of_days() -> list[str]:
     list[str]
         A list of strings with the dates.
     """
-    return list(root_ref.get(shallow=True).keys())
+    return backend.list_days()
 
 def get_last_active_day_data() -> tuple[date, pl.DataFrame]:
     """
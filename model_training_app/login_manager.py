@@ -1,13 +1,31 @@
 import numpy as np
-import pickle
 import polars as pl
 
 from firebase_admin import firestore
 from firebase_admin import auth
+from sklearn.base import clone
+from typing import Any
 
+import model_registry
 import predictor
+from modules import features, storage_backend
 
-db = firestore.client()
+# The accounts are kept in Firebase whatever the storage backend, so it's only
+# connected to when they're used, and the app starts without credentials
+db = None
+
+def get_db() -> Any:
+    """
+    Gets the Firestore client, connecting to Firebase on the first call.
+
+    Returns
+    -------
+    google.cloud.firestore.Client
+    """
+    global db
+    if db is None:
+        db = firestore.client(storage_backend.get_firebase_app())
+    return db
 
 def login(email: str) -> str | None:
     """
@@ -24,7 +42,7 @@ def login(email: str) -> str | None:
         The uid of the user if the user was logged in successfully, None otherwise.
     """
     try:
-        user = auth.get_user_by_email(email)
+        user = auth.get_user_by_email(email, app=storage_backend.get_firebase_app())
         return user.uid
     except Exception as e:
         print(e)
@@ -49,9 +67,9 @@ def register(email: str, password: str, data: dict[str, str]) -> str | None:
         The uid of the user if the user was registered successfully, None otherwise.
     """
     try:
-        user = auth.create_user(email=email, password=password)
+        user = auth.create_user(email=email, password=password, app=storage_backend.get_firebase_app())
 
-        db.collection(u"users").document(user.uid).set(data)
+        get_db().collection(u"users").document(user.uid).set(data)
         return user.uid
     except Exception as e:
         print(e)
@@ -121,17 +139,17 @@ def train_model(data: pl.DataFrame, labels: pl.DataFrame, email: str) -> bool:
     bool
         True if the model was trained successfully, False otherwise.
     """
-    model = predictor.get_model()
+    # Each user gets a copy, so concurrent trainings don't share a model
+    model = clone(predictor.get_model())
 
     try:
-        user = auth.get_user_by_email(email)
+        user = auth.get_user_by_email(email, app=storage_backend.get_firebase_app())
         user_id = user.uid
 
         print(recategorize_y(labels.to_numpy()))
 
-        model.fit(data.to_numpy(), recategorize_y(labels.to_numpy()))
-        with open(f"model_training_app/models/model_{user_id}.pkl", "wb") as f:
-            pickle.dump(model, f)
+        model.fit(features.extract_features(data), recategorize_y(labels.to_numpy()))
+        model_registry.save_model(user_id, model)
 
         return True
     except Exception as e:
@@ -0,0 +1,199 @@
+"""
+This module keeps the models trained for each user. Every training saves a new
+version, named after its number and the hash of its content, so a version is
+never overwritten and saving the same model twice is a no-op. The legacy file
+model_{user_id}.pkl is read as version 0.
+
+Models are loaded the first time they're used and kept in memory while they fit
+in the memory budget, evicting the least recently used ones first. The latest
+version of each user is also kept in memory, so getting a model doesn't list
+the directory of the models, which grows with every training.
+"""
+import hashlib
+import os
+import pickle
+import re
+
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Optional
+
+from modules import forest_engine
+from modules.single_flight import SingleFlight
+
+# ===== Settings ===== #
+MODELS_DIR = "model_training_app/models"
+MAX_MEMORY = 256 * 1024 ** 2 # In bytes, estimated from the size of the files
+
+VERSION_PATTERN = re.compile(r"model_(?P<user_id>.+)_v(?P<version>\d+)_(?P<hash>[0-9a-f]{16})\.pkl")
+
+# Loaded models by path, with the size of their file
+resident: OrderedDict[str, tuple[Any, int]] = OrderedDict()
+resident_size = 0
+resident_lock = Lock()
+# Concurrent loads of the same file share the unpickling
+loads = SingleFlight()
+# Latest version number and path by user, or None if the user has no model, filled
+# when first needed and updated when saving
+latest: dict[str, Optional[tuple[int, str]]] = {}
+latest_lock = Lock()
+# Saves of the same user are serialized, so two of them never get the same version
+save_locks: dict[str, Lock] = {}
+
+# ===== Helper functions ===== #
+def get_legacy_path(user_id: str) -> str:
+    """
+    Gets the path of the model saved before the models were versioned.
+
+    Parameters
+    ----------
+    user_id : str
+        The id of the user.
+
+    Returns
+    -------
+    str
+    """
+    return os.path.join(MODELS_DIR, f"model_{user_id}.pkl")
+
+def list_versions(user_id: str) -> list[tuple[int, str]]:
+    """
+    Lists the saved versions of the model of a user.
+
+    Parameters
+    ----------
+    user_id : str
+        The id of the user.
+
+    Returns
+    -------
+    list[tuple[int, str]]
+        The version numbers and paths, sorted by version.
+    """
+    versions = []
+    if os.path.exists(get_legacy_path(user_id)):
+        versions.append((0, get_legacy_path(user_id)))
+    if os.path.isdir(MODELS_DIR):
+        for name in os.listdir(MODELS_DIR):
+            match = VERSION_PATTERN.fullmatch(name)
+            if match is not None and match["user_id"] == user_id:
+                versions.append((int(match["version"]), os.path.join(MODELS_DIR, name)))
+    return sorted(versions)
+
+def save_model(user_id: str, model: Any) -> int:
+    """
+    Saves a new version of the model of a user, unless it's the same as the latest one.
+
+    Parameters
+    ----------
+    user_id : str
+        The id of the user.
+    model : Any
+        The trained model.
+
+    Returns
+    -------
+    int
+        The version of the saved model.
+    """
+    content = pickle.dumps(model)
+    content_hash = hashlib.sha256(content).hexdigest()[:16]
+
+    with latest_lock:
+        save_lock = save_locks.setdefault(user_id, Lock())
+    with save_lock:
+        versions = list_versions(user_id)
+        if len(versions) > 0 and versions[-1][1].endswith(f"_{content_hash}.pkl"):
+            _set_latest(user_id, *versions[-1])
+            return versions[-1][0]
+
+        version = versions[-1][0] + 1 if len(versions) > 0 else 1
+        path = os.path.join(MODELS_DIR, f"model_{user_id}_v{version}_{content_hash}.pkl")
+        os.makedirs(MODELS_DIR, exist_ok=True)
+        # Write to a temporary file first so the model is never read half written
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "wb") as f:
+            f.write(content)
+        os.replace(temporary_path, path)
+        _set_latest(user_id, version, path)
+        return version
+
+def get_latest_version(user_id: str) -> Optional[tuple[int, str]]:
+    """
+    Gets the latest version of the model of a user, listing the versions only
+    the first time. Users without a model are remembered too, until they save one.
+
+    Parameters
+    ----------
+    user_id : str
+        The id of the user.
+
+    Returns
+    -------
+    tuple[int, str] | None
+        The version number and path, or None if the user doesn't have a model.
+    """
+    with latest_lock:
+        if user_id in latest:
+            return latest[user_id]
+    versions = list_versions(user_id)
+    if len(versions) == 0:
+        with latest_lock:
+            # A save may have finished while listing
+            return latest.setdefault(user_id, None)
+    _set_latest(user_id, *versions[-1])
+    return versions[-1]
+
+def get_model(user_id: str, version: Optional[int] = None) -> Optional[Any]:
+    """
+    Gets the model of a user, ready to predict, loading it if it's not in memory.
+
+    Parameters
+    ----------
+    user_id : str
+        The id of the user.
+    version : int, optional
+        The version of the model, by default the latest one.
+
+    Returns
+    -------
+    Any | None
+        The model, or None if the user doesn't have one.
+    """
+    if version is None:
+        current = get_latest_version(user_id)
+        path = current[1] if current is not None else None
+    else:
+        path = dict(list_versions(user_id)).get(version)
+    if path is None:
+        return None
+
+    with resident_lock:
+        if path in resident:
+            resident.move_to_end(path)
+            return resident[path][0]
+
+    return loads.do(path, _load, path)
+
+def _set_latest(user_id: str, version: int, path: str) -> None:
+    with latest_lock:
+        # A lookup may have listed the versions before the last save
+        if latest.get(user_id) is None or latest[user_id][0] <= version:
+            latest[user_id] = (version, path)
+
+def _load(path: str) -> Any:
+    global resident_size
+
+    with open(path, "rb") as f:
+        model = forest_engine.compile_model(pickle.load(f))
+    size = os.path.getsize(path)
+
+    with resident_lock:
+        if path not in resident:
+            resident[path] = (model, size)
+            resident_size += size
+        # Keep at least the model just loaded, even if it doesn't fit
+        while resident_size > MAX_MEMORY and len(resident) > 1:
+            _, (_, evicted_size) = resident.popitem(last=False)
+            resident_size -= evicted_size
+        return resident[path][0]
@@ -1,13 +1,12 @@
 import dash
-import pickle
 
 from dash import dcc, html, Input, Output, State
 from typing import Optional
 
 import database_manager
 import login_manager
-
-model = None
+import model_registry
+from modules import features, inference_service
 
 dash.register_page(__name__, path="/test-model", redirect_from=["/login"])
 
@@ -22,6 +21,8 @@ layout = html.Div([
     html.Br(),
     html.Div(id="PredictionCardDiv"),
     dcc.Interval(id="interval", interval=500, n_intervals=0),
+    # The user of each browser session, whose model is used for the predictions
+    dcc.Store(id="user-id", storage_type="session"),
 ])
 
 @dash.callback(
@@ -33,30 +34,27 @@ def disable_login_button(email: Optional[str]) -> bool:
 
 @dash.callback(
     Output("text", "children"),
+    Output("user-id", "data"),
     Input("login-button", "n_clicks"),
     State("email", "value"),
 )
-def login(n_clicks: Optional[int], email: str) -> str:
-    global model
-
+def login(n_clicks: Optional[int], email: str) -> tuple[str, Optional[str]]:
     if n_clicks is None:
-        return ""
+        return "", dash.no_update
     user_id = login_manager.login(email)
     if user_id is None:
-        return "Invalid email."
+        return "Invalid email.", None
 
-    with open(f"model_training_app/models/model_{user_id}.pkl", "rb") as f:
-        model = pickle.load(f)
-
-    return f"Logged in as {email}."
+    return f"Logged in as {email}.", user_id
 
 @dash.callback(
     Output("PredictionCardDiv", "children"),
     Input("interval", "n_intervals"),
+    State("user-id", "data"),
 )
-def predict(n_intervals: int) -> html.Div:
-    global model
-
+def predict(n_intervals: int, user_id: Optional[str]) -> html.Div:
+    # The model is loaded on the first prediction and kept in memory while it's used
+    model = model_registry.get_model(user_id) if user_id is not None else None
     if model is None:
         return html.Div(className="card text-white bg-secondary mb-3", children=[
             html.Div(className="card-header", children="Model Prediction"),
@@ -77,9 +75,8 @@ def predict(n_intervals: int) -> html.Div:
             ])
         ], id="PredictionCard", style={"width":"100%"})
 
-    data = data.drop("index")
-    data = data.rows(named=False)
-    prediction = model.predict(data)
+    # Batched with the predictions of the other sessions
+    prediction = inference_service.service.predict(model, features.extract_features(data))
 
     return html.Div(className="card text-white bg-primary mb-3", children=[
             html.Div(className="card-header", children="Model Prediction"),
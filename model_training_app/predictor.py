@@ -6,6 +6,8 @@ import polars as pl
 from datetime import date
 from sklearn.ensemble import RandomForestClassifier
 
+from modules import features
+
 # ===== Load model ===== #
 with open("model.pkl", "rb") as f:
     model = pickle.load(f)
@@ -33,7 +35,7 @@ def get_current_data() -> tuple[str, pl.DataFrame]:
         state = ["Not Sitting"]
     else:
         current_data = current_data.drop("index")
-        state = model.predict(current_data.rows(named=False))
+        state = model.predict(features.extract_features(current_data))
 
     return state[0], current_data
 
@@ -48,8 +50,5 @@ def get_last_active_day_data() -> tuple[date, np.ndarray, pl.DataFrame]:
     """
     day, data = database_manager.get_last_active_day_data()
 
-    data_ = data
-    data = data.drop("index")
-    data = data.rows(named=False)
-    state = model.predict(data)
-    return day, state, data_
+    state = model.predict(features.extract_features(data))
+    return day, state, data
@@ -0,0 +1,124 @@
+/*
+ * Playback of the heatmaps of the time selector. The frames are fetched in chunks
+ * from the playback endpoint, ahead of the one being shown, and drawn in the
+ * browser, so the server only sees a request per chunk.
+ */
+(function () {
+    const MAX_CHUNKS = 32; // Chunks kept in memory
+
+    // Promises of the chunks, by window, step and first frame, in the order they were requested
+    const chunks = new Map();
+
+    function getStep(info, speed, interval) {
+        // Frames advanced per tick, so the playback follows the speed even when the ticks can't
+        return Math.max(1, Math.round(speed * info.rate * interval / 1000));
+    }
+
+    function fetchChunk(info, offset, step) {
+        const key = [info.start, info.end, step, offset].join("|");
+        if (chunks.has(key)) {
+            return chunks.get(key);
+        }
+
+        const parameters = new URLSearchParams({
+            start: info.start, end: info.end, offset: offset, count: info.chunk, step: step
+        });
+        const chunk = fetch(info.url + "?" + parameters).then(async function (response) {
+            if (!response.ok) {
+                throw new Error("Playback request failed: " + response.status);
+            }
+            const buffer = await response.arrayBuffer();
+            const count = parseInt(response.headers.get("X-Frame-Count"));
+            const shape = response.headers.get("X-Frame-Shape").split(",").map(Number);
+            const size = shape.reduce((a, b) => a * b, 1);
+            return {
+                offset: offset,
+                step: step,
+                shape: shape,
+                times: new Float64Array(buffer, 0, count),
+                grids: new Uint16Array(buffer, 8 * count, count * size),
+            };
+        });
+        // Failed requests are tried again the next time
+        chunk.catch(() => chunks.delete(key));
+
+        chunks.set(key, chunk);
+        while (chunks.size > MAX_CHUNKS) {
+            chunks.delete(chunks.keys().next().value);
+        }
+        return chunk;
+    }
+
+    function getLayer(chunk, index, layer) {
+        const [layers, rows, columns] = chunk.shape;
+        const start = (index * layers + layer) * rows * columns;
+        const z = [];
+        for (let row = 0; row < rows; row++) {
+            z.push(Array.from(chunk.grids.subarray(start + row * columns, start + (row + 1) * columns)));
+        }
+        return z;
+    }
+
+    function formatTime(milliseconds) {
+        // The times are local, stored without a timezone
+        const date = new Date(milliseconds);
+        const pad = (value) => String(value).padStart(2, "0");
+        return pad(date.getUTCDate()) + "/" + pad(date.getUTCMonth() + 1) + "/" + date.getUTCFullYear() + " "
+            + pad(date.getUTCHours()) + ":" + pad(date.getUTCMinutes()) + ":" + pad(date.getUTCSeconds());
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        playback: {
+            toggle: function (nClicks) {
+                const playing = (nClicks || 0) % 2 === 1;
+                return [!playing, playing ? "Pause" : "Play"];
+            },
+
+            interval: function (speed, info) {
+                if (!info || !speed || speed <= 0) {
+                    return info ? info.tick : window.dash_clientside.no_update;
+                }
+                // Slow playbacks tick less often instead of showing the same frame
+                return Math.max(info.tick, 1000 / (speed * info.rate));
+            },
+
+            advance: function (nIntervals, frame, info, speed, interval) {
+                if (!info || info.count === 0 || !speed || speed <= 0) {
+                    return window.dash_clientside.no_update;
+                }
+                const step = getStep(info, speed, interval);
+                const next = (Math.floor((frame || 0) / step) + 1) * step;
+                return next < info.count ? next : 0;
+            },
+
+            render: async function (frame, info, speed, paused, interval) {
+                const noUpdate = window.dash_clientside.no_update;
+                if (!info || info.count === 0) {
+                    return [noUpdate, ""];
+                }
+                frame = frame || 0;
+                const step = paused || !speed || speed <= 0 ? 1 : getStep(info, speed, interval);
+                const span = info.chunk * step;
+                const offset = Math.floor(frame / span) * span;
+
+                // Prefetch the next chunk while this one is shown
+                if (offset + span < info.count) {
+                    fetchChunk(info, offset + span, step);
+                }
+                const chunk = await fetchChunk(info, offset, step);
+                const index = Math.min(Math.floor((frame - offset) / step), chunk.times.length - 1);
+                if (index < 0) {
+                    return [noUpdate, ""];
+                }
+
+                const figure = {
+                    data: info.figure.data.map((trace, layer) => Object.assign({}, trace, {
+                        z: getLayer(chunk, index, layer)
+                    })),
+                    layout: info.figure.layout,
+                };
+                return [figure, formatTime(chunk.times[index])];
+            },
+        },
+    });
+})();
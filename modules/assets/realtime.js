@@ -0,0 +1,67 @@
+/*
+ * Heatmaps of the realtime tab. The server sends the values of the sensors and the
+ * browser interpolates the grids with the operator of modules/z_generator.py,
+ * fetched once, and updates only the z of the figure.
+ */
+(function () {
+    // Promise of the operator, with shape (sensors, layers, rows, columns)
+    let operator = null;
+
+    function getOperator(url) {
+        if (operator === null) {
+            operator = fetch(url).then(async function (response) {
+                if (!response.ok) {
+                    throw new Error("Operator request failed: " + response.status);
+                }
+                return {
+                    shape: response.headers.get("X-Operator-Shape").split(",").map(Number),
+                    weights: new Float32Array(await response.arrayBuffer()),
+                };
+            });
+            // Failed requests are tried again the next time
+            operator.catch(() => { operator = null; });
+        }
+        return operator;
+    }
+
+    function interpolate(current, values) {
+        const [sensors, layers, rows, columns] = current.shape;
+        const cells = layers * rows * columns;
+        const grids = new Float64Array(cells);
+        for (let sensor = 0; sensor < sensors; sensor++) {
+            const value = values[sensor];
+            if (value === 0) {
+                continue;
+            }
+            const weights = current.weights.subarray(sensor * cells, (sensor + 1) * cells);
+            for (let cell = 0; cell < cells; cell++) {
+                grids[cell] += value * weights[cell];
+            }
+        }
+
+        const z = [];
+        for (let layer = 0; layer < layers; layer++) {
+            const grid = [];
+            for (let row = 0; row < rows; row++) {
+                const start = (layer * rows + row) * columns;
+                grid.push(Array.from(grids.subarray(start, start + columns)));
+            }
+            z.push(grid);
+        }
+        return z;
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        realtime: {
+            contour: async function (reading) {
+                const patch = new window.dash_clientside.Patch();
+                if (!reading) {
+                    // No data, the heatmaps are emptied
+                    return patch.assign(["data", 0, "z"], []).assign(["data", 1, "z"], []).build();
+                }
+                const z = interpolate(await getOperator(reading.operator), reading.values);
+                return patch.assign(["data", 0, "z"], z[0]).assign(["data", 1, "z"], z[1]).build();
+            },
+        },
+    });
+})();
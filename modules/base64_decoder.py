@@ -14,7 +14,17 @@ KEYS:
     I: IMU array -> offset = 180.0, multiplier = 0.1
     D: Distance sensor array (L4) -> offset = 0, multiplier = 1
     M: Matrix distance sensor array (L5) -> offset = 0, multiplier = 1
+
+For whole days of data, decode_base64_batch decodes every string at once with a
+lookup table and returns one array per key, with a row per string.
+
+For long recordings, iter_decode_base64 reads the strings in chunks from an iterator
+or a file and yields the frames as soon as they are complete. A frame ends at a line
+break or when the key of a frame that was already read appears again.
 """
+import numpy as np
+
+from typing import Iterable, Iterator, Optional, TextIO
 
 BASE64_ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_"
 
@@ -26,6 +36,15 @@ keys = {
     "M": [0, 1]
 }
 
+# Lookup table from a pair of characters, read as a little-endian 16-bit integer,
+# to its combined 12-bit value (-1 for invalid characters)
+_alphabet_codes = np.frombuffer(BASE64_ALPHABET.encode("ascii"), dtype=np.uint8).astype(np.int32)
+LOOKUP_TABLE = np.full(1 << 16, -1, dtype=np.int16)
+LOOKUP_TABLE[_alphabet_codes[:, None] | (_alphabet_codes[None, :] << 8)] = (
+    (np.arange(64)[:, None] << 6) | np.arange(64)[None, :]
+)
+MARKER = ord("~")
+
 
 def combine_pair_base64(pair):
     """
@@ -47,6 +66,25 @@ def combine_pair_base64(pair):
     return combined_value
 
 
+def encode_base64(values):
+    """
+    Encode a dictionary of values as a base64 string, reverting decode_base64
+
+    :param values: a dictionary mapping each key to its list of values
+    :return: the encoded string
+    """
+    encoded_string = ""
+    for dict_key, key_values in values.items():
+        offset, multiplier = keys[dict_key]
+        encoded_string += "~" + dict_key
+        for value in key_values:
+            # The equation used to encode the data: ((input + offset) * multiplier)
+            combined_value = round((value + offset) * multiplier)
+            assert 0 <= combined_value <= 4095
+            encoded_string += BASE64_ALPHABET[combined_value >> 6] + BASE64_ALPHABET[combined_value & 63]
+    return encoded_string
+
+
 def decode_base64(encoded_string):
     """
     Decode a base64 string
@@ -95,3 +133,266 @@ def decode_base64(encoded_string):
                 decoded_values[dict_key] = [decoded_value]
 
     return decoded_values
+
+
+def _combine_codes(pair_codes: np.ndarray) -> np.ndarray:
+    """
+    Combine pairs of characters, read as little-endian 16-bit integers, according to
+    the base64 alphabet
+
+    :param pair_codes: the pairs of characters
+    :return: the combined 12-bit values
+    """
+    combined_values = LOOKUP_TABLE[pair_codes]
+    if np.any(combined_values < 0):
+        raise ValueError("Invalid base64 character")
+    return combined_values.astype(np.int32)
+
+
+def _to_pair_codes(text: str) -> np.ndarray:
+    # Read each pair of characters as a little-endian 16-bit integer: first | (second << 8)
+    return np.frombuffer(text.encode("ascii"), dtype="<u2")
+
+
+def _is_marker(pair_codes: np.ndarray) -> np.ndarray:
+    return (pair_codes & 0xFF) == MARKER
+
+
+def _marker_key(pair_code: int) -> str:
+    dict_key = chr(pair_code >> 8)
+    if dict_key not in keys:
+        raise KeyError(dict_key)
+    return dict_key
+
+
+def _decode_values(dict_key: str, combined_values: np.ndarray) -> np.ndarray:
+    # Same equation as in decode_base64: (input / multiplier) - offset
+    offset, multiplier = keys[dict_key]
+    if offset == 0 and multiplier == 1:
+        return combined_values
+    return (combined_values / multiplier) - offset
+
+
+def _decode_same_layout(pair_codes: np.ndarray) -> dict[str, np.ndarray] | None:
+    """
+    Decode a (rows, pairs) array of strings whose rows have the keys in the same
+    positions, reading the values of each key as columns
+
+    :param pair_codes: the pairs of characters of the strings
+    :return: the decoded values, or None if the rows have different layouts
+    """
+    is_marker = _is_marker(pair_codes[0])
+    if not is_marker[0]:
+        return None
+    if np.any(pair_codes[:, is_marker] != pair_codes[0, is_marker]):
+        return None
+    if np.any(_is_marker(pair_codes[:, ~is_marker])):
+        return None
+
+    columns = {}
+    markers = np.flatnonzero(is_marker)
+    for start, stop in zip(markers, np.append(markers[1:], pair_codes.shape[1])):
+        columns.setdefault(_marker_key(int(pair_codes[0, start])), []).append(pair_codes[:, start + 1:stop])
+
+    return {
+        dict_key: _decode_values(dict_key, _combine_codes(np.hstack(blocks) if len(blocks) > 1 else blocks[0]))
+        for dict_key, blocks in columns.items()
+    }
+
+
+def decode_base64_batch(encoded_strings: list[str]) -> dict[str, np.ndarray]:
+    """
+    Decode a batch of base64 strings at once. Every string is a row and every key
+    must have the same number of values in all the rows.
+
+    The values are the same as the ones returned by decode_base64, but keys without
+    offset and multiplier are returned as integers.
+
+    :param encoded_strings: the strings to be decoded
+    :return: a dictionary mapping each key to a (rows, values) array
+    """
+    n_rows = len(encoded_strings)
+    if n_rows == 0:
+        return {}
+
+    # Check if the strings have a valid length
+    lengths = np.fromiter(map(len, encoded_strings), dtype=np.int64, count=n_rows)
+    if np.any(lengths % 2 != 0):
+        raise ValueError("Invalid string length")
+
+    # Read all the strings at once
+    pair_codes = _to_pair_codes("".join(encoded_strings))
+    # Usually every string has the same keys in the same positions
+    if np.all(lengths == lengths[0]):
+        decoded_values = _decode_same_layout(pair_codes.reshape(n_rows, -1))
+        if decoded_values is not None:
+            return decoded_values
+
+    rows = np.repeat(np.arange(n_rows), lengths // 2)
+
+    # The pairs starting with a tilde set the key for the following pairs
+    is_marker = _is_marker(pair_codes)
+    # Index of the last marker before each pair (-1 if there's none)
+    last_marker = np.maximum.accumulate(np.where(is_marker, np.arange(len(pair_codes)), -1))
+    is_value = ~is_marker
+    # The key is reset at the start of every string
+    if np.any(last_marker[is_value] < 0) or np.any(rows[last_marker[is_value]] != rows[is_value]):
+        raise ValueError("Value found before any key")
+
+    # Combine the two 6-bit values to get the original 12-bit values
+    combined_values = _combine_codes(pair_codes[is_value])
+    value_keys = pair_codes[last_marker[is_value]] >> 8
+    value_rows = rows[is_value]
+
+    decoded_values = {}
+    for marker in np.unique(pair_codes[is_marker]):
+        dict_key = _marker_key(int(marker))
+        selected = value_keys == marker >> 8
+        counts = np.bincount(value_rows[selected], minlength=n_rows)
+        if np.any(counts != counts[0]):
+            raise ValueError(f"Rows have a different number of values for key {dict_key}")
+
+        # The values are sorted by row, so they can be reshaped directly
+        key_values = combined_values[selected].reshape(n_rows, counts[0])
+        decoded_values[dict_key] = _decode_values(dict_key, key_values)
+
+    return decoded_values
+
+
+class StreamDecoder:
+    """
+    Incremental decoder for a stream of base64 frames. The chunks can be split at any
+    character: the pending character and the current key are kept between calls to feed.
+    """
+
+    def __init__(self):
+        self._pending = ""
+        self._key = ""
+        self._frame: dict[str, list[np.ndarray]] = {}
+
+    def feed(self, chunk: str) -> list[dict[str, np.ndarray]]:
+        """
+        Decode a chunk of the stream
+
+        :param chunk: the next characters of the stream
+        :return: the frames completed by this chunk, as combined 12-bit values
+        """
+        frames = []
+        for i, line in enumerate(chunk.split("\n")):
+            # A line break always ends the current frame
+            if i > 0:
+                if self._pending:
+                    raise ValueError("Invalid string length")
+                self._end_frame(frames)
+            self._consume(line.strip("\r"), frames)
+        return frames
+
+    def flush(self) -> list[dict[str, np.ndarray]]:
+        """
+        End the stream, returning the last frame if there's one
+
+        :return: the remaining frames, as combined 12-bit values
+        """
+        if self._pending:
+            raise ValueError("Invalid string length")
+        frames = []
+        self._end_frame(frames)
+        return frames
+
+    def _end_frame(self, frames: list[dict[str, np.ndarray]]) -> None:
+        if self._frame:
+            frames.append({
+                key: np.concatenate(values) if values else np.empty(0, dtype=np.int32)
+                for key, values in self._frame.items()
+            })
+        self._frame = {}
+        self._key = ""
+
+    def _consume(self, text: str, frames: list[dict[str, np.ndarray]]) -> None:
+        text = self._pending + text
+        # Keep the last character for the next chunk if the pair is incomplete
+        end = len(text) - len(text) % 2
+        self._pending = text[end:]
+        if end == 0:
+            return
+
+        pair_codes = _to_pair_codes(text[:end])
+        markers = np.flatnonzero(_is_marker(pair_codes))
+        bounds = np.append(markers, len(pair_codes))
+
+        # Values before the first marker belong to the key of the previous chunk
+        self._append(pair_codes[:bounds[0]])
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            dict_key = _marker_key(int(pair_codes[start]))
+            # A key that was already read starts a new frame
+            if dict_key in self._frame:
+                self._end_frame(frames)
+            self._key = dict_key
+            self._frame.setdefault(dict_key, [])
+            self._append(pair_codes[start + 1:stop])
+
+    def _append(self, pair_codes: np.ndarray) -> None:
+        if len(pair_codes) == 0:
+            return
+        if self._key == "":
+            raise ValueError("Value found before any key")
+        self._frame[self._key].append(_combine_codes(pair_codes))
+
+
+def _iter_chunks(source: Iterable[str] | TextIO, chunk_size: int) -> Iterator[str]:
+    # File-like objects are read in chunks, anything else is iterated over
+    if hasattr(source, "read"):
+        while chunk := source.read(chunk_size):
+            yield chunk if isinstance(chunk, str) else chunk.decode("ascii")
+    else:
+        for chunk in source:
+            yield chunk if isinstance(chunk, str) else chunk.decode("ascii")
+
+
+def _stack_frames(frames: list[dict[str, np.ndarray]]) -> dict[str, np.ndarray]:
+    stacked = {}
+    for dict_key in frames[0]:
+        try:
+            combined_values = np.stack([frame[dict_key] for frame in frames])
+        except (KeyError, ValueError):
+            raise ValueError(f"Rows have a different number of values for key {dict_key}")
+        if any(len(frame) != len(frames[0]) for frame in frames):
+            raise ValueError("Rows have different keys")
+        stacked[dict_key] = _decode_values(dict_key, combined_values)
+    return stacked
+
+
+def iter_decode_base64(source: Iterable[str] | TextIO, batch_size: Optional[int] = None,
+                       chunk_size: int = 65536) -> Iterator[dict]:
+    """
+    Decode a stream of base64 frames incrementally. Only the current chunk and
+    batch are kept in memory.
+
+    :param source: an iterator of string chunks or a file-like object
+    :param batch_size: if given, yield dictionaries of (batch_size, values) arrays
+        (the last one may be smaller) like decode_base64_batch, else yield each frame
+        like decode_base64
+    :param chunk_size: the number of characters read at a time from file-like objects
+    :return: an iterator over the decoded frames or batches
+    """
+    decoder = StreamDecoder()
+    batch = []
+
+    def completed_frames() -> Iterator[dict[str, np.ndarray]]:
+        for chunk in _iter_chunks(source, chunk_size):
+            yield from decoder.feed(chunk)
+        yield from decoder.flush()
+
+    for frame in completed_frames():
+        if batch_size is None:
+            yield {key: _decode_values(key, values).tolist() for key, values in frame.items()}
+            continue
+
+        batch.append(frame)
+        if len(batch) == batch_size:
+            yield _stack_frames(batch)
+            batch = []
+
+    if batch:
+        yield _stack_frames(batch)
+
@@ -2,6 +2,8 @@ import dash_bootstrap_components as dbc
 
 from dash import Dash
 
+from modules import instrumentation, playback
+
 DEBUG_STATE = True
 
 external_stylesheets = [
@@ -11,3 +13,7 @@ external_stylesheets = [
 
 app = Dash(__name__, external_stylesheets=external_stylesheets, update_title=None, suppress_callback_exceptions=True)
 app.title = "SmartChair"
+# Dash callback times and the /metrics endpoint
+instrumentation.instrument_app(app)
+# Heatmap frames for the time selector and the interpolation for the realtime tab
+playback.register_routes(app.server)
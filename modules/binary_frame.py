@@ -0,0 +1,270 @@
+"""
+Compact binary frame format for the sensor data, alongside the base64 pair encoding.
+
+FRAME (version 1, little-endian):
+    Header: magic "SC" (2 bytes), version (1 byte), number of blocks (1 byte),
+            timestamp in milliseconds (8 bytes, signed)
+    Block:  key (1 ASCII byte), number of values (2 bytes),
+            values packed as 12 bits each, two values in every 3 bytes
+
+The values are stored already encoded, with the same offsets and multipliers used by
+the base64 encoding (see base64_decoder.keys).
+
+Since the database only stores text, the frames are saved as standard base64 strings.
+Those never start with a tilde, which is how decode_records tells both formats apart.
+
+Running the module checks that both formats decode to the same values, and compares
+their payload sizes and decoding speed.
+"""
+import base64
+import numpy as np
+import polars as pl
+import struct
+
+from modules import base64_decoder as b64d
+
+MAGIC = b"SC"
+VERSION = 1
+
+HEADER = struct.Struct("<2sBBq")
+BLOCK_HEADER = struct.Struct("<cH")
+
+
+def packed_size(count):
+    """
+    Get the number of bytes used by a block of packed values
+
+    :param count: the number of values
+    :return: the size of the packed values in bytes
+    """
+    return 3 * ((count + 1) // 2)
+
+
+def pack_12bit(values):
+    """
+    Pack 12-bit values, two values in every 3 bytes
+
+    :param values: the values to be packed (0-4095)
+    :return: the packed bytes
+    """
+    values = np.asarray(values, dtype=np.uint16)
+    if np.any(values > 4095):
+        raise ValueError("Values must be in the range (0-4095)")
+    # Pad to an even number of values
+    if len(values) % 2 != 0:
+        values = np.append(values, np.uint16(0))
+    first, second = values[0::2], values[1::2]
+
+    packed = np.empty((len(first), 3), dtype=np.uint8)
+    packed[:, 0] = first & 0xFF
+    packed[:, 1] = (first >> 8) | ((second & 0x0F) << 4)
+    packed[:, 2] = second >> 4
+    return packed.tobytes()
+
+
+def unpack_12bit(packed, count):
+    """
+    Unpack 12-bit values. The last axis of packed holds the packed bytes of one block.
+
+    :param packed: an array of packed bytes, as (..., packed_size(count))
+    :param count: the number of values in the block
+    :return: the unpacked values, as (..., count)
+    """
+    triples = packed.reshape(*packed.shape[:-1], -1, 3).astype(np.int32)
+    values = np.empty((*triples.shape[:-1], 2), dtype=np.int32)
+    values[..., 0] = triples[..., 0] | ((triples[..., 1] & 0x0F) << 8)
+    values[..., 1] = (triples[..., 1] >> 4) | (triples[..., 2] << 4)
+    return values.reshape(*packed.shape[:-1], -1)[..., :count]
+
+
+def encode_frame(values, timestamp):
+    """
+    Encode a dictionary of values as a binary frame
+
+    :param values: a dictionary mapping each key to its list of values
+    :param timestamp: the unix time of the reading in milliseconds
+    :return: the encoded frame
+    """
+    frame = [HEADER.pack(MAGIC, VERSION, len(values), timestamp)]
+    for dict_key, key_values in values.items():
+        offset, multiplier = b64d.keys[dict_key]
+        # The same equation used by the base64 encoding: ((input + offset) * multiplier)
+        combined_values = np.rint((np.asarray(key_values, dtype=np.float64) + offset) * multiplier)
+        frame.append(BLOCK_HEADER.pack(dict_key.encode("ascii"), len(combined_values)))
+        frame.append(pack_12bit(combined_values))
+    return b"".join(frame)
+
+
+def read_layout(buffer):
+    """
+    Read the header and the position of the blocks of a frame, without copying it
+
+    :param buffer: the frame, as bytes or memoryview
+    :return: the timestamp and a list of (key, count, start of the packed values)
+    """
+    buffer = memoryview(buffer)
+    magic, version, n_blocks, timestamp = HEADER.unpack_from(buffer)
+    if magic != MAGIC:
+        raise ValueError("Not a binary frame")
+    if version != VERSION:
+        raise ValueError(f"Unsupported frame version {version}")
+
+    layout = []
+    position = HEADER.size
+    for _ in range(n_blocks):
+        dict_key, count = BLOCK_HEADER.unpack_from(buffer, position)
+        position += BLOCK_HEADER.size
+        layout.append((dict_key.decode("ascii"), count, position))
+        position += packed_size(count)
+    if position != len(buffer):
+        raise ValueError("Invalid frame length")
+    return timestamp, layout
+
+
+def decode_frame(buffer):
+    """
+    Decode a binary frame. The packed values are read in place from the buffer.
+
+    :param buffer: the frame, as bytes or memoryview
+    :return: the timestamp and a dictionary mapping each key to its values
+    """
+    timestamp, layout = read_layout(buffer)
+    decoded_values = {}
+    for dict_key, count, position in layout:
+        packed = np.frombuffer(buffer, dtype=np.uint8, count=packed_size(count), offset=position)
+        decoded_values[dict_key] = b64d._decode_values(dict_key, unpack_12bit(packed, count))
+    return timestamp, decoded_values
+
+
+def decode_frames_batch(frames):
+    """
+    Decode a batch of binary frames. If every frame has the same layout, they're
+    decoded at once as a 2D array, else they're decoded one by one.
+
+    :param frames: the frames to be decoded
+    :return: the timestamps and a dictionary mapping each key to a (rows, values) array
+    """
+    if len(frames) == 0:
+        return np.empty(0, dtype=np.int64), {}
+
+    _, layout = read_layout(frames[0])
+    frame_size = len(frames[0])
+    if any(len(frame) != frame_size for frame in frames):
+        return _decode_frames_one_by_one(frames)
+
+    matrix = np.frombuffer(b"".join(frames), dtype=np.uint8).reshape(len(frames), frame_size)
+    # The headers, except for the timestamp, must match for the columns to line up
+    header_columns = np.r_[0:HEADER.size - 8, [position - j for _, _, position in layout for j in (3, 2, 1)]]
+    if np.any(matrix[:, header_columns] != matrix[0, header_columns]):
+        return _decode_frames_one_by_one(frames)
+
+    timestamps = matrix[:, HEADER.size - 8:HEADER.size].copy().view("<i8").ravel()
+    decoded_values = {}
+    for dict_key, count, position in layout:
+        packed = matrix[:, position:position + packed_size(count)]
+        decoded_values[dict_key] = b64d._decode_values(dict_key, unpack_12bit(packed, count))
+    return timestamps, decoded_values
+
+
+def _decode_frames_one_by_one(frames):
+    timestamps, rows = zip(*map(decode_frame, frames))
+    decoded_values = {}
+    for dict_key in rows[0]:
+        try:
+            decoded_values[dict_key] = np.stack([row[dict_key] for row in rows])
+        except (KeyError, ValueError):
+            raise ValueError(f"Rows have a different number of values for key {dict_key}")
+    return np.array(timestamps, dtype=np.int64), decoded_values
+
+
+def is_base64_record(record):
+    """
+    Check if a record uses the base64 pair encoding instead of the binary frames
+
+    :param record: a record from the database
+    :return: True for base64 pair strings, False for binary frames
+    """
+    return isinstance(record, str) and record.startswith("~")
+
+
+def to_record(frame):
+    """
+    Convert a binary frame to the text saved in the database
+
+    :param frame: the binary frame
+    :return: the frame as a standard base64 string
+    """
+    return base64.b64encode(frame).decode("ascii")
+
+
+def decode_records(records):
+    """
+    Decode a batch of records, detecting the format of each one. Old base64 pair
+    records and binary frames can be mixed, and the rows keep the order of the records.
+
+    :param records: the records to be decoded, as strings or bytes
+    :return: a dictionary mapping each key to a (rows, values) array
+    """
+    try:
+        # Records from the database are always strings, so they're checked at once
+        is_legacy = pl.Series(records, dtype=pl.String).str.starts_with("~").to_numpy()
+    except TypeError:
+        is_legacy = np.fromiter(map(is_base64_record, records), dtype=bool, count=len(records))
+    if is_legacy.all():
+        return b64d.decode_base64_batch(records)
+
+    frames = [
+        base64.b64decode(record) if isinstance(record, str) else record
+        for record, legacy in zip(records, is_legacy) if not legacy
+    ]
+    _, decoded_values = decode_frames_batch(frames)
+    if not is_legacy.any():
+        return decoded_values
+
+    legacy_values = b64d.decode_base64_batch([record for record, legacy in zip(records, is_legacy) if legacy])
+    if legacy_values.keys() != decoded_values.keys():
+        raise ValueError("Records have different keys")
+
+    merged = {}
+    for dict_key, values in decoded_values.items():
+        dtype = np.result_type(values, legacy_values[dict_key])
+        merged[dict_key] = np.empty((len(records), values.shape[1]), dtype=dtype)
+        merged[dict_key][~is_legacy] = values
+        merged[dict_key][is_legacy] = legacy_values[dict_key]
+    return merged
+
+
+if __name__ == "__main__":
+    # Benchmark against the base64 pair encoding with a simulated day of readings
+    from random import randrange
+    from time import perf_counter
+
+    n_rows = 50_000
+    readings = [{"P": [randrange(4096) for _ in range(12)]} for _ in range(n_rows)]
+    legacy_records = [b64d.encode_base64(reading) for reading in readings]
+    frames = [encode_frame(reading, 1_682_000_000_000 + i * 500) for i, reading in enumerate(readings)]
+    text_records = [to_record(frame) for frame in frames]
+
+    # The base64 pairs have no timestamp, so the 13 digits of the database key are counted
+    print(f"Payload size for {n_rows} rows, with the timestamps:")
+    print(f"    base64 pairs:       {sum(map(len, legacy_records)) + 13 * n_rows:>10} bytes")
+    print(f"    binary frames:      {sum(map(len, frames)):>10} bytes")
+    print(f"    binary frames text: {sum(map(len, text_records)):>10} bytes")
+
+    def benchmark(name, function, rows):
+        start = perf_counter()
+        function()
+        elapsed = perf_counter() - start
+        print(f"    {name:<24} {rows / elapsed:>14,.0f} rows/s")
+
+    print("Decode throughput:")
+    benchmark("decode_base64", lambda: [b64d.decode_base64(record) for record in legacy_records[:5000]], 5000)
+    benchmark("decode_base64_batch", lambda: b64d.decode_base64_batch(legacy_records), n_rows)
+    benchmark("decode_frame", lambda: [decode_frame(frame) for frame in frames[:5000]], 5000)
+    benchmark("decode_frames_batch", lambda: decode_frames_batch(frames), n_rows)
+    benchmark("decode_records (text)", lambda: decode_records(text_records), n_rows)
+
+    # Both formats must decode to the same values
+    assert np.array_equal(decode_records(legacy_records)["P"], decode_records(text_records)["P"])
+    mixed = legacy_records[::2] + text_records[1::2]
+    assert np.array_equal(decode_records(mixed)["P"], b64d.decode_base64_batch(legacy_records[::2] + legacy_records[1::2])["P"])
@@ -1,23 +1,40 @@
-import firebase_admin
+import numpy as np
 import polars as pl
-from modules import base64_decoder as b64d
+from modules import binary_frame, day_cache, instrumentation, outlier_filter, realtime_feed, storage_backend
+from modules.single_flight import single_flight
 
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timedelta, date, time
-from firebase_admin import credentials
-from firebase_admin import db
-
-cred = credentials.Certificate("serviceAccountKey.json")
-firebase_admin = firebase_admin.initialize_app(
-    cred, options={
-        "databaseURL": "https://friendly-bazaar-334818-default-rtdb.firebaseio.com"
-    }
-)
+from threading import Lock
+from time import monotonic
+from typing import Iterator, Optional, Union
 
 # The DataFrame doesn't accept the dtype int in the constructor, for some reason
 schema = {f"p{i:02}": pl.Int32 for i in range(12)}
 
-root_ref = db.reference("fake_data_base64")
+backend = storage_backend.get_backend("fake_data_base64")
+
+# Maximum number of days fetched and decoded at the same time
+MAX_WORKERS = 4
+
+# Time in seconds the results are shared between callers, the data from today changes every half second
+DAYS_TTL = 5.0
+DATA_TTL = 0.5
+
+# Time in seconds between saves of the current day in the cache, to start from it after a restart
+SAVE_INTERVAL = 300.0
 
+# ===== Current day sync ===== #
+# The data from the current day is kept in memory and only the readings after
+# the last key seen are fetched
+today = ""
+today_data = pl.DataFrame()
+today_last_key: Optional[str] = None
+today_saved_at = 0.0
+today_lock = Lock()
+
+@single_flight(ttl=DAYS_TTL)
 def get_list_of_days() -> list[str]:
     """
     Gets the list of days that have data.
@@ -26,7 +43,31 @@ def get_list_of_days() -> list[str]:
     -------
         A list of strings with the dates.
     """
-    return list(root_ref.get(shallow=True).keys())
+    with instrumentation.timed("storage_read"):
+        return backend.list_days()
+
+def local_utc_offset(timestamps: np.ndarray) -> np.ndarray:
+    """
+    Gets the local UTC offset of unix timestamps, as done by datetime.fromtimestamp.
+
+    Parameters
+    ----------
+    timestamps : numpy.ndarray
+        The unix timestamps in milliseconds.
+
+    Returns
+    -------
+    numpy.ndarray
+        The offsets in milliseconds.
+    """
+    # The offset changes at multiples of 15 minutes, even in the zones with offsets of
+    # half or three quarters of an hour, so it's calculated once per quarter of an hour
+    quarters, inverse = np.unique(timestamps // 900_000, return_inverse=True)
+    offsets = np.array([
+        datetime.fromtimestamp(quarter * 900).astimezone().utcoffset() // timedelta(milliseconds=1)
+        for quarter in quarters.tolist()
+    ], dtype=np.int64)
+    return offsets[inverse]
 
 def ordered_dict_to_df(data: dict) -> pl.DataFrame:
     """
@@ -42,23 +83,24 @@ def ordered_dict_to_df(data: dict) -> pl.DataFrame:
     polars.DataFrame
     """
     global schema
-    # Decode the base64 strings
-    data = {key: b64d.decode_base64(value) for key, value in data.items()}
-    # Convert the integer keys to the unix time (seconds), then datetime objects
-    index = [datetime.fromtimestamp(float(key) / 1000) for key in data.keys()]
-    # Get only the pressure values
-    data = {key: value["P"] for key, value in data.items()}
-    # Convert the data to a DataFrame
-    result = pl.DataFrame(list(data.values()), schema=schema).with_columns([
-        pl.Series(name="index", values=index),
-    ])
-    # Drop the rows with pressure values above 4095
-    predicate = pl.all(pl.all().exclude("index") < 4096)
-    return result.filter(predicate)
+    # Decode all the records at once, base64 pairs or binary frames, and get only the pressure values
+    with instrumentation.timed("decode"):
+        pressure = binary_frame.decode_records(list(data.values()))["P"]
+    with instrumentation.timed("dataframe"):
+        # Convert the millisecond keys to local datetimes in a single cast
+        timestamps = pl.Series(list(data.keys())).cast(pl.Int64).to_numpy()
+        index = pl.Series("index", timestamps + local_utc_offset(timestamps)).cast(pl.Datetime("ms"))
+        # Drop the rows with pressure values above 4095
+        valid = (pressure < 4096).all(axis=1)
+        return pl.from_numpy(pressure[valid], schema=schema, orient="row").with_columns(index.filter(valid))
 
+@single_flight(ttl=DATA_TTL)
 def get_data_from_day(day: str) -> pl.DataFrame:
     """
-    Gets the data from a specific day.
+    Gets the data from a specific day. Past days are read from the local cache
+    when possible, while cached data from the current day is revalidated first.
+    The current day is kept in memory, see sync_today.
+    Concurrent calls for the same day share a single fetch and decode.
 
     Parameters
     ----------
@@ -70,14 +112,154 @@ def get_data_from_day(day: str) -> pl.DataFrame:
     polars.DataFrame
         A DataFrame with the data from the given day.
     """
+    if day == str(date.today()):
+        return sync_today()[0]
+
+    is_past_day = day < str(date.today())
+
+    data = day_cache.read_day(day)
+    if data is not None:
+        last_key = day_cache.read_last_key(day)
+        # Complete days never change
+        if last_key is None:
+            return data
+        # The day was cached while it was being recorded, so check if there's new data
+        with instrumentation.timed("storage_read"):
+            latest = backend.get_tail(day, limit=1)
+        if len(latest) > 0 and max(latest.keys()) == last_key:
+            if is_past_day:
+                day_cache.mark_complete(day)
+            return data
 
-    result = root_ref.child(day).get()
+    with instrumentation.timed("storage_read"):
+        result = backend.get_day(day)
     if result is None:
         return pl.DataFrame()
-    data = ordered_dict_to_df(result)
+    # Sorted like the cached days, so the rows are in the same order whether cached or not
+    data = ordered_dict_to_df(result).sort("index")
+    day_cache.write_day(day, data, last_key=None if is_past_day else max(result.keys()))
 
     return data
 
+def sync_today() -> tuple[pl.DataFrame, Optional[str]]:
+    """
+    Brings the data from the current day up to date, fetching only the readings
+    after the last key seen. When the day changes, the data starts from the cache,
+    if there's one, or from an empty DataFrame. The day is saved in the cache every
+    SAVE_INTERVAL seconds and when it changes, not on every call.
+
+    Returns
+    -------
+    tuple[polars.DataFrame, str | None]
+        A tuple with the data from the current day and its last key.
+    """
+    global today, today_data, today_last_key, today_saved_at
+
+    with today_lock:
+        day = str(date.today())
+        if day != today:
+            # Keep what was read from the previous day, it's revalidated when used
+            if today_data.shape[0] > 0:
+                day_cache.write_day(today, today_data, last_key=today_last_key)
+            today = day
+            today_data = pl.DataFrame()
+            today_last_key = day_cache.read_last_key(day)
+            today_saved_at = monotonic()
+            if today_last_key is not None:
+                today_data = day_cache.read_day(day)
+                if today_data is None:
+                    today_data, today_last_key = pl.DataFrame(), None
+
+        with instrumentation.timed("storage_read"):
+            result = backend.get_tail(day, start_after=today_last_key)
+        if len(result) > 0:
+            new_data = ordered_dict_to_df(result)
+            today_last_key = max(result.keys())
+            if today_data.shape[0] == 0:
+                today_data = new_data
+            else:
+                today_data = pl.concat([today_data, new_data], rechunk=False)
+                # Merge the small chunks of each update from time to time
+                if today_data.n_chunks() > 32:
+                    today_data = today_data.rechunk()
+            if monotonic() - today_saved_at >= SAVE_INTERVAL:
+                day_cache.write_day(day, today_data, last_key=today_last_key)
+                today_saved_at = monotonic()
+
+        return today_data, today_last_key
+
+# ===== Ranges of days ===== #
+def iter_data_range(start: Union[date, str], end: Union[date, str],
+                    max_workers: int = MAX_WORKERS) -> Iterator[tuple[str, pl.DataFrame]]:
+    """
+    Gets the data from the days in a range, fetching and decoding them in parallel.
+    Only max_workers days are loaded ahead of the one being consumed, so the
+    whole range is never kept in memory by this function.
+
+    Parameters
+    ----------
+    start : datetime.date | str
+        The first day of the range.
+    end : datetime.date | str
+        The last day of the range, inclusive.
+    max_workers : int, optional
+        The maximum number of days loaded at the same time, by default MAX_WORKERS.
+
+    Returns
+    -------
+    Iterator[tuple[str, polars.DataFrame]]
+        The days that have data and their DataFrames, in chronological order.
+    """
+    start, end = str(start), str(end)
+    days = sorted(day for day in get_list_of_days() if start <= day <= end)
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending: deque[tuple[str, Future]] = deque()
+    try:
+        for day in days:
+            if len(pending) >= max_workers:
+                yield _pop_result(pending)
+            pending.append((day, executor.submit(get_data_from_day, day)))
+        while len(pending) > 0:
+            yield _pop_result(pending)
+    finally:
+        # Don't load the rest of the range if the consumer stops early
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def _pop_result(pending: deque[tuple[str, Future]]) -> tuple[str, pl.DataFrame]:
+    day, future = pending.popleft()
+    return day, future.result()
+
+def get_data_range(start: Union[date, str], end: Union[date, str],
+                   max_workers: int = MAX_WORKERS) -> pl.DataFrame:
+    """
+    Gets the data from the days in a range as a single DataFrame sorted by time.
+
+    Parameters
+    ----------
+    start : datetime.date | str
+        The first day of the range.
+    end : datetime.date | str
+        The last day of the range, inclusive.
+    max_workers : int, optional
+        The maximum number of days loaded at the same time, by default MAX_WORKERS.
+
+    Returns
+    -------
+    polars.DataFrame
+        The data from the range, or an empty DataFrame if there's none.
+    """
+    frames = [data for _, data in iter_data_range(start, end, max_workers) if data.shape[0] > 0]
+    if len(frames) == 0:
+        return pl.DataFrame()
+    # The days come in order and each one is sorted, so this is mostly a check
+    return pl.concat(frames).sort("index", maintain_order=True)
+
+# ===== Realtime feed ===== #
+# The latest readings are pushed by the backend as they're saved, so reading them doesn't query the database.
+# The outliers are dropped as they arrive, with the mask predictor.filter_outliers gives on the same readings
+feed = realtime_feed.RealtimeFeed(backend, ordered_dict_to_df, outlier_filter=outlier_filter.OutlierFilter())
+
 def get_current_data() -> pl.DataFrame:
     """
     Gets the data currently being sent by the sensors.
@@ -88,10 +270,9 @@ def get_current_data() -> pl.DataFrame:
     polars.DataFrame
         A one-row DataFrame.
     """
-    result = root_ref.child(str(date.today())).order_by_key().limit_to_last(1).get()
-    if result is None:
+    df = feed.latest()
+    if df.shape[0] == 0:
         return pl.DataFrame()
-    df = ordered_dict_to_df(result)
     # A safe threshold of slightly over two times the data sending interval
     if datetime.now() - df[0, "index"] >= timedelta(seconds=1.05):
         return pl.DataFrame()
@@ -107,8 +288,8 @@ def get_last_active_day_data() -> tuple[date, pl.DataFrame]:
     datetime.date, polars.DataFrame
         A tuple with the date and the DataFrame.
     """
-    result = root_ref.order_by_key().limit_to_last(1).get()
-    if result is None:
+    days = get_list_of_days()
+    if len(days) == 0:
         return date.today(), pl.DataFrame()
-    day = list(result.keys())[0]
-    return date.fromisoformat(day), ordered_dict_to_df(result[day])
+    day = max(days)
+    return date.fromisoformat(day), get_data_from_day(day)
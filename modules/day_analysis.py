@@ -4,9 +4,7 @@ import pandas as pd
 from dash import dcc, html
 
 from modules.base_app import app, DEBUG_STATE
-from modules import database_manager, predictor
-
-model = predictor.get_model()
+from modules import predictor
 
 # Base layout
 layout = dbc.Row([
@@ -23,17 +21,18 @@ layout = dbc.Row([
         # Alerts
         dbc.Col(class_name="panel", children=[
             html.Div("⚠ Alerts:", className="appear", id="alertsTitle"),
-            dcc.Markdown("You remained sitting for more than **2 hours**.", className="appear", id="alertsBody"),
+            dcc.Markdown("You remained sitting for more than **2 hours**.", className="appear alertsBody", id="alertsBody"),
         ]),
     ])
 
 def make_layout(day: str, posture_quality: str, percent: int, tip: str, alerts: list[str]) -> dbc.Row:
     # Alerts
     alerts_list = [html.Div("⚠ Alerts:", className="appear", id="alertsTitle")]
-    for alert in alerts:
-        alerts_list.append(dcc.Markdown(alert, className="appear", id="alertsBody"))
+    # The ids must be unique, so the alerts are styled by their class
+    for i, alert in enumerate(alerts):
+        alerts_list.append(dcc.Markdown(alert, className="appear alertsBody", id=f"alertsBody{i}"))
     if len(alerts_list) == 1:
-        alerts_list.append(dcc.Markdown("*No alerts.*", className="appear", id="alertsBody"))
+        alerts_list.append(dcc.Markdown("*No alerts.*", className="appear alertsBody", id="alertsBody"))
     return dbc.Row([
         dbc.Col([
             dcc.Markdown(f"On the day **{day}**, your posture was:", id="dateText"),
@@ -47,14 +46,14 @@ def make_layout(day: str, posture_quality: str, percent: int, tip: str, alerts:
     ])
 
 def get_layout() -> dbc.Row:
-    last_day, last_day_data = database_manager.get_last_active_day_data()
+    last_day, _, last_day_data = predictor.get_last_active_day_data()
 
     day = last_day.strftime("%d/%m")
 
-    last_day_data = last_day_data.drop("index")
-    evaluated_postures = model.predict(last_day_data.rows(named=False))
+    # The counts are cached with the states, so the day isn't predicted again
+    counts = predictor.get_state_counts(str(last_day), last_day_data)
     try:
-        percent = int((evaluated_postures == "Sitting Correctly").sum() / len(evaluated_postures) * 100)
+        percent = int(counts.get("Sitting Correctly", 0) / sum(counts.values()) * 100)
         if percent < 50:
             posture_quality = "Bad."
             tip = "Tip: Standing up every 50 minutes improves blood circulation in the lower limbs."
@@ -74,6 +73,7 @@ def get_layout() -> dbc.Row:
         posture_quality = "Unexpected data."
         percent = 0
         tip = "Tip: Standing up every 50 minutes improves blood circulation in the lower limbs."
-    alerts = []
+    # Only the readings since the last refresh are segmented again
+    alerts = predictor.get_session_tracker(str(last_day), last_day_data).alerts
 
     return make_layout(day, posture_quality, percent, tip, alerts)
@@ -0,0 +1,286 @@
+"""
+This module keeps a local cache of the decoded days as Arrow IPC files, keyed by date.
+
+Past days never change, so once cached they're never downloaded again. A day cached
+while it was still being recorded is saved along with the last key read from the
+database, so it can be revalidated against the database before being used.
+The cache is bounded in size, evicting the least recently used days first.
+
+Data derived from a day, such as aggregates, can be saved next to it once the day
+is complete. The readings of a day still being recorded keep being appended, so
+its derived data is kept in memory by whoever computes it instead. Derived data is
+removed whenever its day is written again, so it never outlives the data it came from.
+"""
+import os
+import polars as pl
+
+from threading import Lock, get_ident
+from typing import Optional
+
+# ===== Settings ===== #
+CACHE_DIR = "cache"
+MAX_CACHE_SIZE = 1024 ** 3 # In bytes
+
+lock = Lock()
+
+# ===== Helper functions ===== #
+def get_path(day: str) -> str:
+    """
+    Gets the path of the cache file of a day.
+
+    Parameters
+    ----------
+    day : str
+        The day, in the format YYYY-MM-DD.
+
+    Returns
+    -------
+    str
+    """
+    return os.path.join(CACHE_DIR, f"{day}.arrow")
+
+def get_key_path(day: str) -> str:
+    """
+    Gets the path of the file with the last key of a day that was still being recorded.
+
+    Parameters
+    ----------
+    day : str
+        The day, in the format YYYY-MM-DD.
+
+    Returns
+    -------
+    str
+    """
+    return os.path.join(CACHE_DIR, f"{day}.key")
+
+def get_derived_path(day: str, name: str) -> str:
+    """
+    Gets the path of a file with data derived from a day.
+
+    Parameters
+    ----------
+    day : str
+        The day, in the format YYYY-MM-DD.
+    name : str
+        The name of the derived data.
+
+    Returns
+    -------
+    str
+    """
+    return os.path.join(CACHE_DIR, f"{day}.{name}.arrow")
+
+def read_day(day: str) -> Optional[pl.DataFrame]:
+    """
+    Reads a day from the cache. Polars memory maps the file instead of loading it.
+
+    Parameters
+    ----------
+    day : str
+        The day, in the format YYYY-MM-DD.
+
+    Returns
+    -------
+    polars.DataFrame | None
+        The cached data, or None if the day isn't cached.
+    """
+    path = get_path(day)
+    try:
+        # Mark the file as recently used
+        os.utime(path)
+        return pl.read_ipc(path)
+    except FileNotFoundError:
+        return None
+
+def read_last_key(day: str) -> Optional[str]:
+    """
+    Reads the last key of a day that was cached while it was still being recorded.
+
+    Parameters
+    ----------
+    day : str
+        The day, in the format YYYY-MM-DD.
+
+    Returns
+    -------
+    str | None
+        The last key read from the database, or None if the cached day is complete.
+    """
+    try:
+        with open(get_key_path(day)) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+def read_derived(day: str, name: str) -> Optional[pl.DataFrame]:
+    """
+    Reads data derived from a cached day.
+
+    Parameters
+    ----------
+    day : str
+        The day, in the format YYYY-MM-DD.
+    name : str
+        The name of the derived data.
+
+    Returns
+    -------
+    polars.DataFrame | None
+        The derived data, or None if it isn't cached.
+    """
+    try:
+        return pl.read_ipc(get_derived_path(day, name))
+    except FileNotFoundError:
+        return None
+
+def is_complete(day: str) -> bool:
+    """
+    Checks if a day is cached and complete, so data derived from it can be saved.
+
+    Parameters
+    ----------
+    day : str
+        The day, in the format YYYY-MM-DD.
+
+    Returns
+    -------
+    bool
+    """
+    return os.path.exists(get_path(day)) and not os.path.exists(get_key_path(day))
+
+def write_derived(day: str, name: str, data: pl.DataFrame) -> None:
+    """
+    Saves data derived from a cached day. Nothing is saved if the day isn't cached,
+    since the derived data couldn't be invalidated with it, or if it's still being
+    recorded, since the derived data would be outdated by the next readings.
+
+    Parameters
+    ----------
+    day : str
+        The day, in the format YYYY-MM-DD.
+    name : str
+        The name of the derived data.
+    data : polars.DataFrame
+        The derived data.
+    """
+    path = get_derived_path(day, name)
+    temporary_path = f"{path}.{os.getpid()}-{get_ident()}.tmp"
+    data.write_ipc(temporary_path)
+
+    with lock:
+        if is_complete(day):
+            os.replace(temporary_path, path)
+        else:
+            _remove(temporary_path)
+
+def write_day(day: str, data: pl.DataFrame, last_key: Optional[str] = None) -> None:
+    """
+    Saves a day in the cache, evicting old days if the cache gets too big.
+    The day is saved sorted by time and uncompressed, so it can be memory mapped
+    and binary searched.
+
+    Parameters
+    ----------
+    day : str
+        The day, in the format YYYY-MM-DD.
+    data : polars.DataFrame
+        The decoded data of the day.
+    last_key : str, optional
+        The last key read from the database, if the day is still being recorded.
+        Days saved without it are considered complete and are never revalidated.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = get_path(day)
+    # Write to a temporary file first so readers never see a partial file
+    temporary_path = f"{path}.{os.getpid()}-{get_ident()}.tmp"
+    data.sort("index").write_ipc(temporary_path, compression="uncompressed")
+
+    with lock:
+        os.replace(temporary_path, path)
+        for derived_path in _list_derived_paths(day):
+            _remove(derived_path)
+        if last_key is None:
+            _remove(get_key_path(day))
+        else:
+            with open(get_key_path(day), "w") as f:
+                f.write(last_key)
+
+    evict()
+
+def mark_complete(day: str) -> None:
+    """
+    Marks a cached day as complete, so it's no longer revalidated.
+
+    Parameters
+    ----------
+    day : str
+        The day, in the format YYYY-MM-DD.
+    """
+    with lock:
+        _remove(get_key_path(day))
+
+def invalidate(day: Optional[str] = None) -> None:
+    """
+    Removes a day from the cache.
+
+    Parameters
+    ----------
+    day : str, optional
+        The day, in the format YYYY-MM-DD. If not given, the whole cache is cleared.
+    """
+    with lock:
+        days = [day] if day is not None else _list_cached_days()
+        for cached_day in days:
+            _remove_day(cached_day)
+
+def evict(max_size: int = MAX_CACHE_SIZE) -> None:
+    """
+    Removes the least recently used days until the cache fits in the given size.
+
+    Parameters
+    ----------
+    max_size : int, optional
+        The maximum size of the cache in bytes, by default MAX_CACHE_SIZE.
+    """
+    with lock:
+        files = []
+        for day in _list_cached_days():
+            try:
+                stat = os.stat(get_path(day))
+                size = stat.st_size + sum(os.path.getsize(path) for path in _list_derived_paths(day))
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, size, day))
+
+        total_size = sum(size for _, size, _ in files)
+        for _, size, day in sorted(files):
+            if total_size <= max_size:
+                break
+            _remove_day(day)
+            total_size -= size
+
+def _list_cached_days() -> list[str]:
+    if not os.path.isdir(CACHE_DIR):
+        return []
+    # Derived files also end with .arrow, but have a name between the day and the extension
+    return [name[:-len(".arrow")] for name in os.listdir(CACHE_DIR)
+            if name.endswith(".arrow") and name.count(".") == 1]
+
+def _list_derived_paths(day: str) -> list[str]:
+    if not os.path.isdir(CACHE_DIR):
+        return []
+    return [os.path.join(CACHE_DIR, name) for name in os.listdir(CACHE_DIR)
+            if name.startswith(f"{day}.") and name.endswith(".arrow") and name.count(".") == 2]
+
+def _remove_day(day: str) -> None:
+    _remove(get_path(day))
+    _remove(get_key_path(day))
+    for derived_path in _list_derived_paths(day):
+        _remove(derived_path)
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
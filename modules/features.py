@@ -0,0 +1,61 @@
+"""
+This module converts the sensor data to the input of the models: a contiguous float32
+matrix with the sensors in order, built by Polars without going through Python objects.
+"""
+import numpy as np
+import polars as pl
+
+from threading import Lock
+
+# ===== Settings ===== #
+SENSORS = [f"p{i:02}" for i in range(12)]
+
+# Schemas already checked, so each kind of DataFrame is only checked once
+checked_schemas: set[tuple[tuple[str, pl.DataType], ...]] = set()
+checked_schemas_lock = Lock()
+
+# ===== Helper functions ===== #
+def check_schema(data: pl.DataFrame) -> None:
+    """
+    Checks that a DataFrame has all the sensor columns, with numeric values.
+
+    Parameters
+    ----------
+    data : polars.DataFrame
+        The data to check.
+
+    Raises
+    ------
+    ValueError
+        If a sensor column is missing or isn't numeric.
+    """
+    schema = tuple(data.schema.items())
+    if schema in checked_schemas:
+        return
+
+    for sensor in SENSORS:
+        if sensor not in data.schema:
+            raise ValueError(f"Missing sensor column: {sensor}")
+        if not data.schema[sensor].is_numeric():
+            raise ValueError(f"Sensor column {sensor} isn't numeric: {data.schema[sensor]}")
+
+    with checked_schemas_lock:
+        checked_schemas.add(schema)
+
+def extract_features(data: pl.DataFrame) -> np.ndarray:
+    """
+    Gets the model input from the sensor data. Other columns, such as "index", are ignored.
+
+    Parameters
+    ----------
+    data : polars.DataFrame
+        The sensor data.
+
+    Returns
+    -------
+    numpy.ndarray
+        A C-contiguous float32 matrix with a row per reading and a column per sensor.
+    """
+    check_schema(data)
+    # Polars gives the columns side by side, then NumPy converts them in a single pass
+    return np.ascontiguousarray(data.select(SENSORS).to_numpy(), dtype=np.float32)
@@ -0,0 +1,231 @@
+"""
+This module runs the predictions of a fitted RandomForestClassifier without sklearn's
+per-call overhead, which dominates when predicting a single row per tick.
+
+The trees are flattened into NumPy arrays of nodes: the feature and threshold of the
+splits, the children and the normalized class probabilities of the leaves. Leaves
+point to themselves. A few rows are moved down all the trees at once, one level at a
+time, until every tree stops at a leaf. Larger batches go through one tree at a time,
+dropping the rows as they reach a leaf, so the arrays of the tree stay in the CPU cache.
+Batches of more than a few hundred rows are still faster in sklearn's compiled loops,
+so the engine is meant for the small batches of the realtime path.
+
+The results are the same as sklearn's, since the input is converted to float32, the
+probabilities of the trees are added in the same order and the ties are broken in
+the same way. Running the module checks this on the saved model, or a random one,
+and compares the speed of both.
+"""
+import numpy as np
+
+from typing import Any
+
+# ===== Settings ===== #
+# Batches up to this size go down all the trees at once
+SMALL_BATCH = 256
+CHUNK_SIZE = 65536 # Rows predicted at once, bounds the memory used
+# Levels between the removals of the rows that reached a leaf, which cost more than a level
+COMPACT_INTERVAL = 4
+
+class ForestEngine:
+    """
+    Inference engine of a fitted RandomForestClassifier with a single output.
+
+    Parameters
+    ----------
+    forest : sklearn.ensemble.RandomForestClassifier
+        The fitted forest.
+    """
+
+    def __init__(self, forest: Any):
+        self.classes_ = forest.classes_
+        trees = [estimator.tree_ for estimator in forest.estimators_]
+        self.n_trees = len(trees)
+        self.n_features = forest.n_features_in_
+
+        offsets = np.cumsum([0] + [tree.node_count for tree in trees])
+        self.roots = offsets[:-1].astype(np.intp)
+
+        features, thresholds, children, is_leaf, values = [], [], [], [], []
+        for offset, tree in zip(offsets, trees):
+            nodes = np.arange(tree.node_count, dtype=np.intp) + offset
+            leaf = tree.children_left == -1
+            features.append(np.where(leaf, 0, tree.feature))
+            thresholds.append(tree.threshold)
+            # The right child comes first, so the child is children[2 * node + go_left]
+            children.append(np.stack([
+                np.where(leaf, nodes, tree.children_right + offset),
+                np.where(leaf, nodes, tree.children_left + offset),
+            ], axis=1).ravel())
+            is_leaf.append(leaf)
+            value = tree.value[:, 0, :].astype(np.float64)
+            normalizer = value.sum(axis=1)[:, np.newaxis]
+            # Since sklearn 1.4 the values are already the fractions of the classes, and
+            # dividing them again by their sum, close to 1, would change the last digits
+            if not np.allclose(normalizer, 1.0):
+                # Older versions keep the weighted counts, normalized by DecisionTreeClassifier.predict_proba
+                normalizer[normalizer == 0.0] = 1.0
+                value = value / normalizer
+            values.append(value)
+
+        self.features = np.concatenate(features).astype(np.intp)
+        self.thresholds = np.concatenate(thresholds).astype(np.float64)
+        self.children = np.concatenate(children).astype(np.intp)
+        self.is_leaf = np.concatenate(is_leaf)
+        self.values = np.concatenate(values)
+
+    def _step(self, X_flat: np.ndarray, positions: np.ndarray, nodes: np.ndarray) -> np.ndarray:
+        # positions are the offsets of the rows in X_flat. The float32 values are
+        # compared with the float64 thresholds, like sklearn, so NaN goes right
+        go_left = X_flat[positions + self.features[nodes]] <= self.thresholds[nodes]
+        return self.children[2 * nodes + go_left]
+
+    def apply(self, X: np.ndarray) -> np.ndarray:
+        """
+        Gets the leaf reached by each row in each tree.
+
+        Parameters
+        ----------
+        X : numpy.ndarray
+            The rows, already converted to a contiguous float32 array.
+
+        Returns
+        -------
+        numpy.ndarray
+            The global indices of the leaves, with shape (rows, trees).
+        """
+        X_flat = X.ravel()
+        if X.shape[0] == 1:
+            # Single rows, as predicted every tick, skip the row offsets
+            nodes = self.roots
+            while True:
+                go_left = X_flat[self.features[nodes]] <= self.thresholds[nodes]
+                next_nodes = self.children[2 * nodes + go_left]
+                if np.array_equal(next_nodes, nodes):
+                    return nodes.reshape(1, self.n_trees)
+                nodes = next_nodes
+
+        if X.shape[0] <= SMALL_BATCH:
+            positions = np.repeat(np.arange(X.shape[0]) * self.n_features, self.n_trees)
+            nodes = np.tile(self.roots, X.shape[0])
+            while True:
+                next_nodes = self._step(X_flat, positions, nodes)
+                if np.array_equal(next_nodes, nodes):
+                    return nodes.reshape(X.shape[0], self.n_trees)
+                nodes = next_nodes
+
+        leaves = np.empty((self.n_trees, X.shape[0]), dtype=np.intp)
+        for tree, root in enumerate(self.roots):
+            rows = np.arange(X.shape[0])
+            positions = rows * self.n_features
+            nodes = np.full(X.shape[0], root)
+            while rows.size > 0:
+                # Leaves point to themselves, so the rows can stay a few levels after reaching one
+                for _ in range(COMPACT_INTERVAL):
+                    nodes = self._step(X_flat, positions, nodes)
+                done = self.is_leaf[nodes]
+                leaves[tree, rows[done]] = nodes[done]
+                remaining = ~done
+                rows, positions, nodes = rows[remaining], positions[remaining], nodes[remaining]
+        return leaves.T
+
+    def predict_proba(self, X: Any) -> np.ndarray:
+        """
+        Predicts the probability of each class.
+
+        Parameters
+        ----------
+        X : array-like
+            The rows, with shape (rows, features).
+
+        Returns
+        -------
+        numpy.ndarray
+            The probabilities, with shape (rows, classes).
+        """
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if X.shape[1] != self.n_features:
+            raise ValueError(f"X has {X.shape[1]} features, but the model expects {self.n_features}")
+
+        proba = np.zeros((X.shape[0], len(self.classes_)), dtype=np.float64)
+        for start in range(0, X.shape[0], CHUNK_SIZE):
+            chunk = slice(start, start + CHUNK_SIZE)
+            leaves = self.apply(X[chunk])
+            # Added tree by tree, in the same order as sklearn
+            for tree in range(self.n_trees):
+                proba[chunk] += self.values[leaves[:, tree]]
+        proba /= self.n_trees
+        return proba
+
+    def predict(self, X: Any) -> np.ndarray:
+        """
+        Predicts the class of each row.
+
+        Parameters
+        ----------
+        X : array-like
+            The rows, with shape (rows, features).
+
+        Returns
+        -------
+        numpy.ndarray
+            The classes, one per row.
+        """
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1), axis=0)
+
+def compile_model(model: Any) -> Any:
+    """
+    Gets the inference engine of a model, or the model itself if it can't be compiled,
+    such as when it isn't a fitted forest with a single output.
+
+    Parameters
+    ----------
+    model : Any
+        The model.
+
+    Returns
+    -------
+    ForestEngine | Any
+        An object with the predict method.
+    """
+    estimators = getattr(model, "estimators_", None)
+    if not estimators or getattr(model, "n_outputs_", 1) != 1 or not hasattr(model, "classes_"):
+        return model
+    if not all(hasattr(estimator, "tree_") for estimator in estimators):
+        return model
+    return ForestEngine(model)
+
+if __name__ == "__main__":
+    import os
+    import pickle
+    from time import perf_counter
+    from sklearn.ensemble import RandomForestClassifier
+
+    rng = np.random.default_rng(0)
+    if os.path.exists("model.pkl"):
+        with open("model.pkl", "rb") as f:
+            model = pickle.load(f)
+    else:
+        # A forest like the posture model, trained on random pressure values
+        X_train = rng.integers(0, 4096, (20_000, 12))
+        y_train = rng.choice(["Leaning Backward", "Leaning Forward", "Not Sitting", "Sitting Correctly"], 20_000)
+        model = RandomForestClassifier(random_state=0).fit(X_train, y_train)
+    engine = compile_model(model)
+
+    def benchmark(function, X, repeat):
+        times = []
+        for _ in range(repeat):
+            start = perf_counter()
+            function(X)
+            times.append(perf_counter() - start)
+        return np.median(times)
+
+    for rows, repeat in [(1, 200), (100_000, 3)]:
+        X = rng.integers(0, 4096, (rows, model.n_features_in_)).astype(np.int32)
+        assert np.array_equal(engine.predict(X), model.predict(X))
+        assert np.array_equal(engine.predict_proba(X), model.predict_proba(X))
+        sklearn_time = benchmark(model.predict, X, repeat)
+        engine_time = benchmark(engine.predict, X, repeat)
+        print(f"{rows} rows: sklearn {sklearn_time * 1000:.3f} ms, engine {engine_time * 1000:.3f} ms "
+              f"({sklearn_time / engine_time:.1f}x)")
@@ -0,0 +1,131 @@
+"""
+This module queries the decoded history by time, using the days in the local cache
+as segments. The segments are memory mapped and sorted by time, so a window is
+found with a binary search on the timestamps and returned as slices of the
+segments, without copying them. Besides the timestamps of the days it overlaps,
+only the pages of the window end up in memory.
+"""
+import numpy as np
+import polars as pl
+
+from datetime import date, datetime, timedelta
+
+from modules import database_manager, pyramid
+
+# ===== Helper functions ===== #
+def get_days(start: datetime, end: datetime) -> list[str]:
+    """
+    Gets the days with data that overlap a window.
+
+    Parameters
+    ----------
+    start : datetime.datetime
+        The start of the window.
+    end : datetime.datetime
+        The end of the window, exclusive.
+
+    Returns
+    -------
+    list[str]
+        The sorted days, in the format YYYY-MM-DD.
+    """
+    first, last = str(start.date()), str((end - timedelta(milliseconds=1)).date())
+    return sorted(day for day in database_manager.get_list_of_days() if first <= day <= last)
+
+def slice_window(data: pl.DataFrame, start: datetime, end: datetime) -> pl.DataFrame:
+    """
+    Gets the rows of a DataFrame sorted by "index" that are inside a window.
+
+    Parameters
+    ----------
+    data : polars.DataFrame
+        The data, sorted by "index".
+    start : datetime.datetime
+        The start of the window.
+    end : datetime.datetime
+        The end of the window, exclusive.
+
+    Returns
+    -------
+    polars.DataFrame
+        A slice of the data, sharing its memory.
+    """
+    if data.shape[0] == 0:
+        return data
+    # The physical values of the index are the milliseconds, read without a copy
+    timestamps = data["index"].to_physical().to_numpy()
+    bounds = np.array([start, end], dtype="datetime64[ms]").astype(np.int64)
+    first, last = np.searchsorted(timestamps, bounds, side="left")
+    return data.slice(first, last - first)
+
+def get_window(start: datetime, end: datetime) -> pl.DataFrame:
+    """
+    Gets the data inside a window of time. Days not yet cached are downloaded first.
+
+    Parameters
+    ----------
+    start : datetime.datetime
+        The start of the window.
+    end : datetime.datetime
+        The end of the window, exclusive.
+
+    Returns
+    -------
+    polars.DataFrame
+        The data sorted by time, or an empty DataFrame if there's none.
+    """
+    slices = []
+    for day in get_days(start, end):
+        window = slice_window(_get_segment(day), start, end)
+        if window.shape[0] > 0:
+            slices.append(window)
+    if len(slices) == 0:
+        return pl.DataFrame()
+    # Keep each slice as a chunk instead of copying them together
+    return pl.concat(slices, rechunk=False)
+
+def get_levels(start: datetime, end: datetime) -> dict[int, pl.DataFrame]:
+    """
+    Gets the aggregates of the days inside a window of time.
+
+    Parameters
+    ----------
+    start : datetime.datetime
+        The start of the window.
+    end : datetime.datetime
+        The end of the window, exclusive.
+
+    Returns
+    -------
+    dict[int, polars.DataFrame]
+        The levels by their bucket size in seconds, with the buckets that start inside the window.
+    """
+    levels: dict[int, list[pl.DataFrame]] = {seconds: [] for seconds in pyramid.LEVELS}
+    for day in get_days(start, end):
+        for seconds, level in pyramid.get_levels(day, _get_segment(day)).items():
+            levels[seconds].append(slice_window(level, start, end))
+    return {seconds: pl.concat(parts, rechunk=False) for seconds, parts in levels.items() if len(parts) > 0}
+
+def day_window(day: date) -> tuple[datetime, datetime]:
+    """
+    Gets the window of time of a whole day.
+
+    Parameters
+    ----------
+    day : datetime.date
+        The day.
+
+    Returns
+    -------
+    tuple[datetime.datetime, datetime.datetime]
+        The start of the day and the start of the next one.
+    """
+    start = datetime.combine(day, datetime.min.time())
+    return start, start + timedelta(days=1)
+
+def _get_segment(day: str) -> pl.DataFrame:
+    # Cached days are memory mapped, the others are downloaded and cached
+    data = database_manager.get_data_from_day(day)
+    if data.shape[0] > 0 and not data["index"].is_sorted():
+        data = data.sort("index")
+    return data
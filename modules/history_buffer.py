@@ -0,0 +1,117 @@
+"""
+This module keeps the recent readings of a chair for the history graph of the
+realtime tab. The readings are saved in fixed NumPy arrays used as a ring buffer,
+so the memory doesn't grow however long the server runs.
+
+The buffer is shared by all the viewers of the chair. Each one keeps the time of
+the last reading it got, and only the readings after it are sent, so the graph is
+extended instead of sent again on every update.
+"""
+import numpy as np
+
+from threading import Lock
+from typing import Optional
+
+# ===== Settings ===== #
+CAPACITY = 1200 # Number of readings kept, ten minutes at the sensor rate
+
+class HistoryBuffer:
+    """
+    Ring buffer of the latest readings, sorted by time.
+
+    Parameters
+    ----------
+    sensors : int
+        The number of values of each reading.
+    capacity : int, optional
+        The number of readings kept, by default CAPACITY.
+    """
+
+    def __init__(self, sensors: int, capacity: int = CAPACITY):
+        # Times as milliseconds since the epoch
+        self.times = np.zeros(capacity, dtype=np.int64)
+        self.values = np.zeros((capacity, sensors), dtype=np.float64)
+        self.head = 0 # Position of the next reading
+        self.count = 0
+        self.lock = Lock()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def append(self, time: int, values: np.ndarray) -> bool:
+        """
+        Adds a reading, overwriting the oldest one if the buffer is full.
+
+        Parameters
+        ----------
+        time : int
+            The time of the reading, in milliseconds since the epoch.
+        values : numpy.ndarray
+            The values of the sensors.
+
+        Returns
+        -------
+        bool
+            True if it was added, False if it isn't newer than the last reading,
+            such as when several viewers send the same one.
+        """
+        with self.lock:
+            capacity = self.times.shape[0]
+            if self.count > 0 and time <= self.times[(self.head - 1) % capacity]:
+                return False
+            self.times[self.head] = time
+            self.values[self.head] = values
+            self.head = (self.head + 1) % capacity
+            self.count = min(self.count + 1, capacity)
+            return True
+
+    def since(self, time: Optional[int] = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Gets the readings after a time.
+
+        Parameters
+        ----------
+        time : int, optional
+            The time in milliseconds since the epoch, by default all the readings are returned.
+
+        Returns
+        -------
+        tuple[numpy.ndarray, numpy.ndarray]
+            Copies of the times and the values, with shape (readings, sensors), sorted by time.
+        """
+        with self.lock:
+            capacity = self.times.shape[0]
+            order = (self.head - self.count + np.arange(self.count)) % capacity
+            times = self.times[order]
+            start = 0 if time is None else np.searchsorted(times, time, side="right")
+            return times[start:], self.values[order[start:]]
+
+    def clear(self) -> None:
+        """Forgets the readings."""
+        with self.lock:
+            self.head = 0
+            self.count = 0
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+
+    # The buffer keeps the last readings, as a list truncated after each append
+    buffer = HistoryBuffer(12, capacity=50)
+    expected = []
+    time = 0
+    for _ in range(500):
+        time += int(rng.integers(0, 3))
+        values = rng.integers(0, 4096, 12)
+        if len(expected) == 0 or time > expected[-1][0]:
+            expected = (expected + [(time, values)])[-50:]
+            assert buffer.append(time, values)
+        else:
+            assert not buffer.append(time, values)
+
+        cursor = int(rng.integers(time - 60, time + 1))
+        times, result = buffer.since(cursor)
+        kept = [(t, v) for t, v in expected if t > cursor]
+        assert np.array_equal(times, [t for t, _ in kept])
+        assert np.array_equal(result, np.array([v for _, v in kept]).reshape(-1, 12))
+    assert len(buffer) == 50
+    print("HistoryBuffer matches a list of the last readings")
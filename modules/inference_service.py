@@ -0,0 +1,192 @@
+"""
+This module batches the predictions requested by concurrent callers, such as the
+dashboards and the training app sessions, which each predict a single row per tick.
+A worker collects the requests that arrive within a short window, runs one predict
+per model and returns each caller its rows, so the per-call overhead is paid once.
+
+Waiting for the window only pays off when there are other callers. A caller alone,
+such as a single dashboard, predicts its rows directly in its own thread, which
+avoids adding the window to every prediction.
+"""
+import numpy as np
+
+from concurrent.futures import Future
+from queue import Empty, Queue
+from threading import Lock, Thread
+from time import monotonic
+from typing import Any, Optional
+
+# ===== Settings ===== #
+WINDOW = 0.005 # Time in seconds the worker waits for more requests
+MAX_BATCH_SIZE = 256 # Rows per batch, the batches stay small enough for the inference engine
+
+class _Request:
+    """Rows to predict with a model, and the future that receives the result."""
+
+    def __init__(self, model: Any, rows: np.ndarray):
+        self.model = model
+        self.rows = rows
+        self.future: Future = Future()
+
+class InferenceService:
+    """
+    Service that predicts the requested rows in batches, in a background thread.
+
+    Parameters
+    ----------
+    window : float, optional
+        The time in seconds the worker waits for more requests, by default WINDOW.
+    max_batch_size : int, optional
+        The maximum number of rows per batch, by default MAX_BATCH_SIZE.
+    """
+
+    def __init__(self, window: float = WINDOW, max_batch_size: int = MAX_BATCH_SIZE):
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.queue: Queue[_Request] = Queue()
+        self.worker: Optional[Thread] = None
+        self.lock = Lock()
+        # Callers waiting for their predictions
+        self.callers = 0
+        # Statistics
+        self.direct_requests = 0
+        self.requests = 0
+        self.batches = 0
+        self.rows = 0
+        self.max_batch_rows = 0
+        self.max_queue_depth = 0
+
+    def submit(self, model: Any, rows: np.ndarray) -> Future:
+        """
+        Requests the prediction of some rows.
+
+        Parameters
+        ----------
+        model : Any
+            An object with the predict method. Requests are batched per model.
+        rows : numpy.ndarray
+            The rows, with shape (rows, features).
+
+        Returns
+        -------
+        concurrent.futures.Future
+            The future that receives the predictions.
+        """
+        self._start()
+        request = _Request(model, rows)
+        self.queue.put(request)
+        with self.lock:
+            self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+        return request.future
+
+    def predict(self, model: Any, rows: np.ndarray) -> np.ndarray:
+        """
+        Predicts some rows, waiting for the batch they're added to. If no other
+        caller is waiting, the rows are predicted right away instead.
+
+        Parameters
+        ----------
+        model : Any
+            An object with the predict method.
+        rows : numpy.ndarray
+            The rows, with shape (rows, features).
+
+        Returns
+        -------
+        numpy.ndarray
+            The predictions, one per row.
+        """
+        with self.lock:
+            self.callers += 1
+            alone = self.callers == 1 and self.queue.empty()
+            if alone:
+                self.direct_requests += 1
+        try:
+            if alone:
+                return model.predict(rows)
+            return self.submit(model, rows).result()
+        finally:
+            with self.lock:
+                self.callers -= 1
+
+    def stats(self) -> dict[str, float]:
+        """
+        Gets the statistics of the service.
+
+        Returns
+        -------
+        dict[str, float]
+            The current and maximum queue depths, the number of requests predicted
+            right away, the number of requests, batches and rows predicted by the
+            worker, and the mean and maximum batch sizes in rows.
+        """
+        with self.lock:
+            return {
+                "queue_depth": self.queue.qsize(),
+                "max_queue_depth": self.max_queue_depth,
+                "direct_requests": self.direct_requests,
+                "requests": self.requests,
+                "batches": self.batches,
+                "rows": self.rows,
+                "mean_batch_size": self.rows / self.batches if self.batches > 0 else 0.0,
+                "max_batch_size": self.max_batch_rows,
+            }
+
+    def _start(self) -> None:
+        if self.worker is not None:
+            return
+        with self.lock:
+            if self.worker is None:
+                self.worker = Thread(target=self._run, daemon=True)
+                self.worker.start()
+
+    def _run(self) -> None:
+        while True:
+            requests = [self.queue.get()]
+            size = len(requests[0].rows)
+            deadline = monotonic() + self.window
+            while size < self.max_batch_size:
+                timeout = deadline - monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self.queue.get(timeout=timeout)
+                except Empty:
+                    break
+                requests.append(request)
+                size += len(request.rows)
+
+            # Requests for different models, such as the ones of each user, can't be batched together
+            groups: dict[int, list[_Request]] = {}
+            for request in requests:
+                groups.setdefault(id(request.model), []).append(request)
+            for group in groups.values():
+                self._predict(group)
+
+    def _predict(self, requests: list[_Request]) -> None:
+        try:
+            rows = np.concatenate([request.rows for request in requests])
+            predictions = requests[0].model.predict(rows)
+        except Exception as error:
+            if len(requests) == 1:
+                requests[0].future.set_exception(error)
+            else:
+                # Predict them one by one, so only the invalid requests fail
+                for request in requests:
+                    self._predict([request])
+            return
+
+        with self.lock:
+            self.requests += len(requests)
+            self.batches += 1
+            self.rows += len(rows)
+            self.max_batch_rows = max(self.max_batch_rows, len(rows))
+
+        start = 0
+        for request in requests:
+            end = start + len(request.rows)
+            request.future.set_result(predictions[start:end])
+            start = end
+
+# The service shared by the whole process
+service = InferenceService()
@@ -0,0 +1,183 @@
+"""
+This module measures the time spent in each stage of the pipeline, such as reading
+the database, decoding, predicting and building the figures, and in each Dash
+callback. The latest durations of each stage are kept to get their percentiles,
+and are served in the Prometheus text format at /metrics.
+
+The measurements can be turned on and off at runtime with set_enabled, and start
+as set by the SMARTCHAIR_METRICS environment variable, on by default. When they're
+off, timed doesn't read the clock or record anything.
+"""
+import numpy as np
+import os
+
+from collections import deque
+from contextlib import contextmanager
+from dash import Dash
+from flask import Response, g, request
+from threading import Lock
+from time import perf_counter
+from typing import Iterator
+
+from modules import inference_service
+
+# ===== Settings ===== #
+MAX_SAMPLES = 2048 # Latest durations kept per stage for the percentiles
+QUANTILES = [0.5, 0.95, 0.99]
+DASH_CALLBACK_PATH = "/_dash-update-component"
+
+enabled = os.environ.get("SMARTCHAIR_METRICS", "1") != "0"
+
+class _Stage:
+    """The durations of a stage, all time totals and the latest ones."""
+
+    def __init__(self):
+        self.samples: deque[float] = deque(maxlen=MAX_SAMPLES)
+        self.count = 0
+        self.total = 0.0
+
+# Stages by metric and label, such as ("stage", "decode") or ("callback", "realTimeContourGraph.figure")
+stages: dict[tuple[str, str], _Stage] = {}
+lock = Lock()
+
+# ===== Helper functions ===== #
+def set_enabled(value: bool) -> None:
+    """
+    Turns the measurements on or off. The ones already taken are kept.
+
+    Parameters
+    ----------
+    value : bool
+    """
+    global enabled
+    enabled = value
+
+def observe(name: str, seconds: float, metric: str = "stage") -> None:
+    """
+    Records a duration.
+
+    Parameters
+    ----------
+    name : str
+        The name of the stage.
+    seconds : float
+        The duration in seconds.
+    metric : str, optional
+        The metric the stage belongs to, by default "stage".
+    """
+    with lock:
+        stage = stages.get((metric, name))
+        if stage is None:
+            stage = stages[(metric, name)] = _Stage()
+        stage.samples.append(seconds)
+        stage.count += 1
+        stage.total += seconds
+
+@contextmanager
+def timed(name: str) -> Iterator[None]:
+    """
+    Measures the time spent in a block with a monotonic clock, if the measurements are on.
+
+    Parameters
+    ----------
+    name : str
+        The name of the stage.
+    """
+    if not enabled:
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, perf_counter() - start)
+
+def snapshot() -> dict[tuple[str, str], dict[str, float]]:
+    """
+    Gets the statistics of each stage.
+
+    Returns
+    -------
+    dict[tuple[str, str], dict[str, float]]
+        The count, sum and percentiles of the latest durations, by metric and stage.
+    """
+    with lock:
+        copies = {key: (np.array(stage.samples), stage.count, stage.total) for key, stage in stages.items()}
+
+    result = {}
+    for key, (samples, count, total) in copies.items():
+        statistics = {"count": count, "sum": total}
+        percentiles = np.quantile(samples, QUANTILES) if len(samples) > 0 else [np.nan] * len(QUANTILES)
+        for quantile, value in zip(QUANTILES, percentiles):
+            statistics[str(quantile)] = float(value)
+        result[key] = statistics
+    return result
+
+def reset() -> None:
+    """Removes the measurements taken."""
+    with lock:
+        stages.clear()
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def render_prometheus() -> str:
+    """
+    Formats the statistics of the stages and of the inference service in the Prometheus text format.
+
+    Returns
+    -------
+    str
+    """
+    by_metric: dict[str, list[tuple[str, dict[str, float]]]] = {}
+    for (metric, name), statistics in sorted(snapshot().items()):
+        by_metric.setdefault(metric, []).append((name, statistics))
+
+    lines = []
+    for metric, entries in by_metric.items():
+        family = f"smartchair_{metric}_seconds"
+        lines.append(f"# HELP {family} Time spent in each {metric}, percentiles of the latest {MAX_SAMPLES}.")
+        lines.append(f"# TYPE {family} summary")
+        for name, statistics in entries:
+            label = f"{metric}=\"{escape_label(name)}\""
+            for quantile in QUANTILES:
+                lines.append(f"{family}{{{label},quantile=\"{quantile}\"}} {statistics[str(quantile)]:.9g}")
+            lines.append(f"{family}_sum{{{label}}} {statistics['sum']:.9g}")
+            lines.append(f"{family}_count{{{label}}} {statistics['count']}")
+
+    for name, value in inference_service.service.stats().items():
+        lines.append(f"# TYPE smartchair_inference_{name} gauge")
+        lines.append(f"smartchair_inference_{name} {value:.9g}")
+
+    lines.append("# TYPE smartchair_metrics_enabled gauge")
+    lines.append(f"smartchair_metrics_enabled {int(enabled)}")
+    return "\n".join(lines) + "\n"
+
+def instrument_app(app: Dash) -> None:
+    """
+    Measures the time of the Dash callbacks of an app and serves the metrics at /metrics.
+
+    Parameters
+    ----------
+    app : dash.Dash
+        The app.
+    """
+    server = app.server
+
+    @server.before_request
+    def start_callback_timer() -> None:
+        if enabled and request.path.endswith(DASH_CALLBACK_PATH):
+            g.callback_start = perf_counter()
+
+    @server.teardown_request
+    def stop_callback_timer(error: BaseException = None) -> None:
+        start = g.pop("callback_start", None)
+        if start is None:
+            return
+        # The callbacks are identified by their outputs
+        body = request.get_json(silent=True) or {}
+        observe(str(body.get("output", "unknown")), perf_counter() - start, metric="callback")
+
+    @server.route("/metrics")
+    def metrics() -> Response:
+        return Response(render_prometheus(), mimetype="text/plain; version=0.0.4")
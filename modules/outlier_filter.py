@@ -0,0 +1,125 @@
+"""
+This module detects outliers by the deviation of consecutive readings: a reading is
+an outlier if the sum over the sensors of the standard deviation of the last
+window_size readings reaches the threshold. The first readings use the ones
+available so far, and a single reading has no deviation.
+
+The filter has a batch form, for the history, and a streaming form, for the live
+data, that give the same mask. Both compute the deviations with the same sequence
+of operations over the same window, so the results are equal to the last bit.
+Welford's method with the removal of the oldest reading would be O(1) too, but its
+rounding errors depend on the whole history, so the two forms could disagree on
+readings close to the threshold. The window is small and fixed, so computing it
+again for each reading is still constant time per sample.
+"""
+import numpy as np
+
+from collections import deque
+
+# ===== Settings ===== #
+WINDOW_SIZE = 3
+THRESHOLD = 1000.0
+
+# ===== Helper functions ===== #
+def window_variation(windows: np.ndarray) -> np.ndarray:
+    """
+    Gets the sum over the sensors of the sample standard deviations of windows of readings.
+    The operations are done one by one in a fixed order, so the result doesn't
+    depend on how many windows are computed at once.
+
+    Parameters
+    ----------
+    windows : numpy.ndarray
+        The readings, with shape (windows, readings per window, sensors).
+
+    Returns
+    -------
+    numpy.ndarray
+        The variation of each window.
+    """
+    count = windows.shape[1]
+    if count < 2:
+        return np.zeros(windows.shape[0])
+
+    total = windows[:, 0].copy()
+    for i in range(1, count):
+        total += windows[:, i]
+    mean = total / count
+
+    squares = (windows[:, 0] - mean) ** 2
+    for i in range(1, count):
+        squares += (windows[:, i] - mean) ** 2
+    deviations = np.sqrt(squares / (count - 1))
+
+    variation = deviations[:, 0].copy()
+    for sensor in range(1, deviations.shape[1]):
+        variation += deviations[:, sensor]
+    return variation
+
+def outlier_mask(values: np.ndarray, window_size: int = WINDOW_SIZE,
+                 threshold: float = THRESHOLD) -> np.ndarray:
+    """
+    Gets which readings aren't outliers.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        The readings sorted by time, with shape (readings, sensors).
+    window_size : int, optional
+        The number of readings compared, by default WINDOW_SIZE.
+    threshold : float, optional
+        The maximum variation of the readings kept, by default THRESHOLD.
+
+    Returns
+    -------
+    numpy.ndarray
+        A boolean array, True for the readings to keep.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    variation = np.zeros(values.shape[0])
+    # The first readings only have the previous ones
+    for i in range(min(window_size - 1, values.shape[0])):
+        variation[i] = window_variation(values[np.newaxis, :i + 1])[0]
+    if values.shape[0] >= window_size:
+        # A view with shape (windows, sensors, readings), moved to (windows, readings, sensors)
+        windows = np.lib.stride_tricks.sliding_window_view(values, window_size, axis=0)
+        variation[window_size - 1:] = window_variation(windows.transpose(0, 2, 1))
+    return variation < threshold
+
+class OutlierFilter:
+    """
+    Streaming form of outlier_mask, which checks the readings one at a time.
+
+    Parameters
+    ----------
+    window_size : int, optional
+        The number of readings compared, by default WINDOW_SIZE.
+    threshold : float, optional
+        The maximum variation of the readings kept, by default THRESHOLD.
+    """
+
+    def __init__(self, window_size: int = WINDOW_SIZE, threshold: float = THRESHOLD):
+        self.threshold = threshold
+        self.window: deque[np.ndarray] = deque(maxlen=window_size)
+
+    def update(self, reading: np.ndarray) -> bool:
+        """
+        Adds a reading to the window and checks it.
+
+        Parameters
+        ----------
+        reading : numpy.ndarray
+            The values of the sensors.
+
+        Returns
+        -------
+        bool
+            True if the reading should be kept, False if it's an outlier.
+        """
+        self.window.append(np.asarray(reading, dtype=np.float64))
+        variation = window_variation(np.stack(self.window)[np.newaxis])[0]
+        return bool(variation < self.threshold)
+
+    def reset(self) -> None:
+        """Forgets the previous readings, such as when the data has a gap."""
+        self.window.clear()
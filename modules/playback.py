@@ -0,0 +1,167 @@
+"""
+This module serves the heatmaps of a window of the history for the playback of the
+time selector. The frames are interpolated in batches and sent in chunks of
+uint16 grids, which the client prefetches and draws by itself, so playing a day
+doesn't need a callback per frame.
+
+It also serves the interpolation operator, so the realtime heatmaps are computed
+by the client from the values of the sensors.
+
+A chunk is requested at /playback/frames with the window, the first frame, the
+number of frames and the step between them, so fast playbacks only get the frames
+they show. The window is read once when it's selected and its chunks are sliced
+from it, so they match the frames counted by the time selector even while the
+current day gets new readings. The body has the times of the frames, as float64 milliseconds since the
+epoch, followed by the grids, all little-endian.
+"""
+import numpy as np
+import polars as pl
+
+from collections import OrderedDict
+from datetime import datetime
+from flask import Flask, Response, request
+from threading import Lock
+
+from modules import features, history_archive, z_generator
+
+# ===== Settings ===== #
+CHUNK_SIZE = 64 # Frames per chunk requested by the client
+MAX_CHUNK_SIZE = 256
+ROUTE = "/playback/frames"
+OPERATOR_ROUTE = "/playback/operator"
+MAX_WINDOWS = 4 # Windows kept for the playbacks, the latest selections of the viewers
+
+# ===== Variables ===== #
+# Data of the windows being played, by their bounds
+windows: OrderedDict[tuple[datetime, datetime], pl.DataFrame] = OrderedDict()
+windows_lock = Lock()
+
+# ===== Helper functions ===== #
+def get_window(start: datetime, end: datetime, reload: bool = False) -> pl.DataFrame:
+    """
+    Gets the data of a window being played, reading it only the first time.
+
+    Parameters
+    ----------
+    start : datetime.datetime
+        The start of the window.
+    end : datetime.datetime
+        The end of the window, exclusive.
+    reload : bool, optional
+        Whether to read the window again, such as when it's selected, by default False.
+
+    Returns
+    -------
+    polars.DataFrame
+        The data sorted by time.
+    """
+    key = (start, end)
+    with windows_lock:
+        if not reload and key in windows:
+            windows.move_to_end(key)
+            return windows[key]
+
+    data = history_archive.get_window(start, end)
+    with windows_lock:
+        windows[key] = data
+        windows.move_to_end(key)
+        while len(windows) > MAX_WINDOWS:
+            windows.popitem(last=False)
+    return data
+
+def get_frames(start: datetime, end: datetime, offset: int, count: int, step: int = 1) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Gets the heatmaps of some readings of a window.
+
+    Parameters
+    ----------
+    start : datetime.datetime
+        The start of the window.
+    end : datetime.datetime
+        The end of the window, exclusive.
+    offset : int
+        The position of the first reading in the window.
+    count : int
+        The maximum number of frames.
+    step : int, optional
+        The number of readings between frames, by default 1.
+
+    Returns
+    -------
+    tuple[numpy.ndarray, numpy.ndarray]
+        The times of the frames, as milliseconds since the epoch, and the grids,
+        with shape (frames, 2, rows, columns).
+    """
+    data = get_window(start, end)
+    rows = data.slice(offset, (count - 1) * step + 1).gather_every(step) if data.shape[0] > 0 else data
+    if rows.shape[0] == 0:
+        return np.array([], dtype=np.float64), np.zeros((0, *z_generator.grids_base.shape), dtype=np.uint16)
+
+    times = rows["index"].cast(pl.Datetime("ms")).to_physical().to_numpy().astype(np.float64)
+    return times, z_generator.interpolate_frames(features.extract_features(rows))
+
+def encode_frames(times: np.ndarray, frames: np.ndarray) -> bytes:
+    """
+    Encodes frames in the format of the playback endpoint.
+
+    Parameters
+    ----------
+    times : numpy.ndarray
+        The times of the frames.
+    frames : numpy.ndarray
+        The grids.
+
+    Returns
+    -------
+    bytes
+    """
+    return times.astype("<f8").tobytes() + frames.astype("<u2").tobytes()
+
+def encode_operator() -> bytes:
+    """
+    Encodes the interpolation operator as little-endian float32, which is precise
+    enough for the heatmaps and half the size.
+
+    Returns
+    -------
+    bytes
+    """
+    return z_generator.interpolation_operator.astype("<f4").tobytes()
+
+def register_routes(server: Flask) -> None:
+    """
+    Adds the playback endpoints to the server of the app.
+
+    Parameters
+    ----------
+    server : flask.Flask
+        The server.
+    """
+    @server.route(ROUTE)
+    def playback_frames() -> Response:
+        try:
+            start = datetime.fromisoformat(request.args["start"])
+            end = datetime.fromisoformat(request.args["end"])
+            offset = int(request.args.get("offset", 0))
+            count = int(request.args.get("count", CHUNK_SIZE))
+            step = int(request.args.get("step", 1))
+        except (KeyError, ValueError):
+            return Response("Invalid window or frames.", status=400, mimetype="text/plain")
+        if offset < 0 or not 0 < count <= MAX_CHUNK_SIZE or step < 1:
+            return Response("Invalid window or frames.", status=400, mimetype="text/plain")
+
+        times, frames = get_frames(start, end, offset, count, step)
+        response = Response(encode_frames(times, frames), mimetype="application/octet-stream")
+        response.headers["X-Frame-Count"] = str(len(times))
+        response.headers["X-Frame-Shape"] = ",".join(str(size) for size in frames.shape[1:])
+        return response
+
+    @server.route(OPERATOR_ROUTE)
+    def playback_operator() -> Response:
+        response = Response(encode_operator(), mimetype="application/octet-stream")
+        # Sensors by the shape of the stacked grids
+        shape = (z_generator.interpolation_operator.shape[0], *z_generator.grids_base.shape)
+        response.headers["X-Operator-Shape"] = ",".join(str(size) for size in shape)
+        # The operator only changes with the code, so the browser keeps it
+        response.headers["Cache-Control"] = "public, max-age=3600"
+        return response
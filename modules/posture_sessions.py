@@ -0,0 +1,273 @@
+"""
+This module segments the posture states in runs and sitting sessions, and raises
+alerts when a session or a bad posture lasts too long. The tracker consumes the
+states as they arrive, in constant time per reading, and backfills a day in a
+single vectorized pass that leaves it as if the readings were consumed one by one.
+
+A session is a sequence of readings in any sitting state, ended by "Not Sitting" or
+by a gap in the data. A bad posture is a sequence of sitting states other than
+"Sitting Correctly". Each session and each bad posture raises its alert once.
+"""
+import numpy as np
+
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from threading import Lock
+from typing import Optional
+
+# ===== Settings ===== #
+SITTING_LIMIT = timedelta(hours=2)
+BAD_POSTURE_LIMIT = timedelta(minutes=30)
+MAX_GAP = timedelta(minutes=1) # Longer gaps in the data end the sessions
+MAX_MEMORY_ENTRIES = 8
+
+NOT_SITTING = "Not Sitting"
+SITTING_CORRECTLY = "Sitting Correctly"
+
+# ===== Helper functions ===== #
+def to_microseconds(value: timedelta) -> int:
+    return value // timedelta(microseconds=1)
+
+def to_datetime(microseconds: int) -> datetime:
+    return np.datetime64(int(microseconds), "us").astype(datetime)
+
+def format_duration(value: timedelta) -> str:
+    """
+    Formats a duration for the alerts, such as "2 hours" or "30 minutes".
+
+    Parameters
+    ----------
+    value : datetime.timedelta
+        The duration, in whole minutes.
+
+    Returns
+    -------
+    str
+    """
+    minutes = int(value.total_seconds() // 60)
+    if minutes % 60 == 0:
+        hours = minutes // 60
+        return f"{hours} hour" if hours == 1 else f"{hours} hours"
+    return f"{minutes} minute" if minutes == 1 else f"{minutes} minutes"
+
+def sitting_alert(start: int) -> str:
+    return f"You remained sitting for more than **{format_duration(SITTING_LIMIT)}**, since {to_datetime(start):%H:%M}."
+
+def bad_posture_alert(start: int) -> str:
+    return f"You kept a bad posture for more than **{format_duration(BAD_POSTURE_LIMIT)}**, since {to_datetime(start):%H:%M}."
+
+class PostureSessionTracker:
+    """
+    Tracker of the runs of each state, the sitting sessions and the alerts of a day.
+
+    Attributes
+    ----------
+    count : int
+        The number of readings consumed.
+    last_time : int | None
+        The time of the last reading, in microseconds since the epoch.
+    state : str | None
+        The state of the last reading.
+    run_start : int | None
+        The time the current run of the same state started.
+    run_length : int
+        The number of readings in the current run.
+    session_start : int | None
+        The time the current sitting session started, None if not sitting.
+    bad_start : int | None
+        The time the current bad posture started, None if not in a bad posture.
+    sessions : list[tuple[datetime.datetime, datetime.datetime]]
+        The start and end of the finished sitting sessions.
+    alerts : list[str]
+        The alerts raised, in Markdown.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.last_time: Optional[int] = None
+        self.state: Optional[str] = None
+        self.run_start: Optional[int] = None
+        self.run_length = 0
+        self.session_start: Optional[int] = None
+        self.sitting_alerted = False
+        self.bad_start: Optional[int] = None
+        self.bad_alerted = False
+        self.sessions: list[tuple[datetime, datetime]] = []
+        self.alerts: list[str] = []
+
+    def update(self, time: datetime, state: str) -> list[str]:
+        """
+        Consumes a reading.
+
+        Parameters
+        ----------
+        time : datetime.datetime
+            The time of the reading, after the previous one.
+        state : str
+            The posture state of the reading.
+
+        Returns
+        -------
+        list[str]
+            The alerts raised by the reading.
+        """
+        now = int(np.datetime64(time, "us").astype(np.int64))
+        gap = self.last_time is not None and now - self.last_time > to_microseconds(MAX_GAP)
+        seated = state != NOT_SITTING
+        bad = seated and state != SITTING_CORRECTLY
+
+        if self.session_start is not None and (not seated or gap):
+            self.sessions.append((to_datetime(self.session_start), to_datetime(self.last_time)))
+            self.session_start = None
+            self.sitting_alerted = False
+        if seated and self.session_start is None:
+            self.session_start = now
+        if self.bad_start is not None and (not bad or gap):
+            self.bad_start = None
+            self.bad_alerted = False
+        if bad and self.bad_start is None:
+            self.bad_start = now
+
+        if state != self.state or gap:
+            self.state = state
+            self.run_start = now
+            self.run_length = 0
+        self.run_length += 1
+        self.last_time = now
+        self.count += 1
+
+        alerts = []
+        if (self.session_start is not None and not self.sitting_alerted
+                and now - self.session_start >= to_microseconds(SITTING_LIMIT)):
+            self.sitting_alerted = True
+            alerts.append(sitting_alert(self.session_start))
+        if (self.bad_start is not None and not self.bad_alerted
+                and now - self.bad_start >= to_microseconds(BAD_POSTURE_LIMIT)):
+            self.bad_alerted = True
+            alerts.append(bad_posture_alert(self.bad_start))
+        self.alerts.extend(alerts)
+        return alerts
+
+    @classmethod
+    def backfill(cls, index: np.ndarray, states: np.ndarray) -> "PostureSessionTracker":
+        """
+        Builds a tracker from the readings of a day at once, in the same state as if
+        they were consumed one by one.
+
+        Parameters
+        ----------
+        index : numpy.ndarray[datetime64]
+            The times of the readings, sorted.
+        states : numpy.ndarray[str]
+            The posture states of the readings.
+
+        Returns
+        -------
+        PostureSessionTracker
+        """
+        tracker = cls()
+        count = len(states)
+        if count == 0:
+            return tracker
+
+        times = index.astype("datetime64[us]").astype(np.int64)
+        states = states.astype(str)
+        seated = states != NOT_SITTING
+        bad = seated & (states != SITTING_CORRECTLY)
+        gap = np.zeros(count, dtype=bool)
+        gap[1:] = np.diff(times) > to_microseconds(MAX_GAP)
+
+        # Alerts by row, sorted by row and then as update raises them
+        alerts: list[tuple[int, int, str]] = []
+        sessions, sitting_alerted = _segment(times, seated, gap, to_microseconds(SITTING_LIMIT))
+        bad_runs, bad_alerted = _segment(times, bad, gap, to_microseconds(BAD_POSTURE_LIMIT))
+        for row, start in sitting_alerted:
+            alerts.append((row, 0, sitting_alert(start)))
+        for row, start in bad_alerted:
+            alerts.append((row, 1, bad_posture_alert(start)))
+        tracker.alerts = [alert for _, _, alert in sorted(alerts)]
+
+        # The last session is still open if the last reading is seated
+        for start, end in sessions:
+            if end < count - 1:
+                tracker.sessions.append((to_datetime(times[start]), to_datetime(times[end])))
+        if seated[-1]:
+            tracker.session_start = int(times[sessions[-1][0]])
+            tracker.sitting_alerted = len(sitting_alerted) > 0 and sitting_alerted[-1][0] >= sessions[-1][0]
+        if bad[-1]:
+            tracker.bad_start = int(times[bad_runs[-1][0]])
+            tracker.bad_alerted = len(bad_alerted) > 0 and bad_alerted[-1][0] >= bad_runs[-1][0]
+
+        changes = np.flatnonzero(gap[1:] | (states[1:] != states[:-1])) + 1
+        run_start = changes[-1] if len(changes) > 0 else 0
+        tracker.state = str(states[-1])
+        tracker.run_start = int(times[run_start])
+        tracker.run_length = int(count - run_start)
+        tracker.last_time = int(times[-1])
+        tracker.count = count
+        return tracker
+
+def _segment(times: np.ndarray, mask: np.ndarray, gap: np.ndarray,
+             limit: int) -> tuple[list[tuple[int, int]], list[tuple[int, int]]]:
+    # Segments of consecutive rows in the mask without gaps, as first and last rows,
+    # and the first row where each one reaches the limit, with the time it started
+    previous = np.zeros(len(mask), dtype=bool)
+    previous[1:] = mask[:-1]
+    following_gap = np.zeros(len(mask), dtype=bool)
+    following_gap[:-1] = gap[1:]
+    next_in_mask = np.zeros(len(mask), dtype=bool)
+    next_in_mask[:-1] = mask[1:]
+    starts = np.flatnonzero(mask & (gap | ~previous))
+    ends = np.flatnonzero(mask & (following_gap | ~next_in_mask))
+    if len(starts) == 0:
+        return [], []
+
+    segment = np.cumsum(mask & (gap | ~previous)) - 1
+    elapsed = times - times[starts][np.maximum(segment, 0)]
+    reached = np.flatnonzero(mask & (elapsed >= limit))
+    _, first = np.unique(segment[reached], return_index=True)
+    alerted = [(int(row), int(times[starts[segment[row]]])) for row in reached[first]]
+    return list(zip(starts.tolist(), ends.tolist())), alerted
+
+# ===== Trackers of the days ===== #
+memory: OrderedDict[tuple[str, str], PostureSessionTracker] = OrderedDict()
+lock = Lock()
+
+def get_tracker(day: str, fingerprint: str, index: np.ndarray, states: np.ndarray) -> PostureSessionTracker:
+    """
+    Gets the tracker of a day, consuming only the readings after the ones it already has.
+
+    Parameters
+    ----------
+    day : str
+        The day, in the format YYYY-MM-DD.
+    fingerprint : str
+        The fingerprint of the model that predicted the states.
+    index : numpy.ndarray[datetime64]
+        The times of the readings of the day. Readings can only be appended to it between calls.
+    states : numpy.ndarray[str]
+        The posture states of the readings.
+
+    Returns
+    -------
+    PostureSessionTracker
+    """
+    key = (day, fingerprint)
+    with lock:
+        tracker = memory.get(key)
+        count = len(states)
+        # The tracker is still valid if the readings it consumed are the start of the data
+        valid = (tracker is not None and tracker.count <= count and (tracker.count == 0
+                 or int(index[tracker.count - 1].astype("datetime64[us]").astype(np.int64)) == tracker.last_time))
+        if not valid:
+            tracker = PostureSessionTracker.backfill(index, states)
+        else:
+            for time, state in zip(index[tracker.count:].astype("datetime64[us]").tolist(),
+                                   states[tracker.count:].astype(str).tolist()):
+                tracker.update(time, state)
+
+        memory[key] = tracker
+        memory.move_to_end(key)
+        while len(memory) > MAX_MEMORY_ENTRIES:
+            memory.popitem(last=False)
+        return tracker
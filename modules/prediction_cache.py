@@ -0,0 +1,163 @@
+"""
+This module keeps the posture states predicted for each day, keyed by the day and
+the fingerprint of the model, so a day is only predicted once per model. The states
+are kept in memory and saved next to the day in the cache once it's complete, so a
+past day is never predicted again. The states of a day that's still being recorded
+are only kept in memory, and extended with the predictions of the new readings only.
+"""
+import numpy as np
+import polars as pl
+
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Optional
+
+from modules import day_cache
+
+# ===== Settings ===== #
+MAX_MEMORY_ENTRIES = 8
+
+class _Entry:
+    """
+    The states of a day for a model, with the time of the last reading predicted
+    and whether they're saved in the cache.
+    """
+
+    def __init__(self, states: np.ndarray, last_index: Optional[object], saved: bool = False):
+        self.states = states
+        self.last_index = last_index
+        self.saved = saved
+        self.counts: Optional[dict[str, int]] = None
+
+memory: OrderedDict[tuple[str, str], _Entry] = OrderedDict()
+lock = Lock()
+
+# ===== Helper functions ===== #
+def get_name(fingerprint: str) -> str:
+    """
+    Gets the name of the states in the day cache.
+
+    Parameters
+    ----------
+    fingerprint : str
+        The fingerprint of the model.
+
+    Returns
+    -------
+    str
+    """
+    return f"states-{fingerprint}"
+
+def get_states(day: str, fingerprint: str, data: pl.DataFrame,
+               predict: Callable[[pl.DataFrame], np.ndarray]) -> np.ndarray:
+    """
+    Gets the states of each reading of a day, predicting only the ones not cached.
+
+    Parameters
+    ----------
+    day : str
+        The day, in the format YYYY-MM-DD.
+    fingerprint : str
+        The fingerprint of the model.
+    data : polars.DataFrame
+        The readings of the day. Readings can only be appended to it between calls.
+    predict : Callable[[polars.DataFrame], numpy.ndarray]
+        The function that predicts the states of some readings.
+
+    Returns
+    -------
+    numpy.ndarray
+        The states, one per reading.
+    """
+    return _get_entry(day, fingerprint, data, predict).states
+
+def get_state_counts(day: str, fingerprint: str, data: pl.DataFrame,
+                     predict: Callable[[pl.DataFrame], np.ndarray]) -> dict[str, int]:
+    """
+    Gets the number of readings of a day in each state.
+
+    Parameters
+    ----------
+    day : str
+        The day, in the format YYYY-MM-DD.
+    fingerprint : str
+        The fingerprint of the model.
+    data : polars.DataFrame
+        The readings of the day. Readings can only be appended to it between calls.
+    predict : Callable[[polars.DataFrame], numpy.ndarray]
+        The function that predicts the states of some readings.
+
+    Returns
+    -------
+    dict[str, int]
+        The number of readings by state.
+    """
+    entry = _get_entry(day, fingerprint, data, predict)
+    if entry.counts is None:
+        names, counts = np.unique(entry.states.astype(str), return_counts=True)
+        entry.counts = dict(zip(names.tolist(), counts.tolist()))
+    return entry.counts
+
+def invalidate() -> None:
+    """Removes the states kept in memory. The saved ones are removed with their day."""
+    with lock:
+        memory.clear()
+
+def _get_entry(day: str, fingerprint: str, data: pl.DataFrame,
+               predict: Callable[[pl.DataFrame], np.ndarray]) -> _Entry:
+    key = (day, fingerprint)
+    rows = data.shape[0]
+    with lock:
+        entry = memory.get(key)
+        if entry is not None:
+            memory.move_to_end(key)
+
+    if entry is None or not _is_prefix(entry, data):
+        entry = _read(day, fingerprint)
+        if entry is not None and not _is_prefix(entry, data):
+            entry = None
+
+    if entry is not None and len(entry.states) == rows:
+        _remember(key, entry)
+        _save(day, fingerprint, data, entry)
+        return entry
+
+    # Only the readings after the cached ones are predicted
+    start = 0 if entry is None else len(entry.states)
+    new_states = predict(data.slice(start)) if rows > start else np.array([], dtype=object)
+    states = new_states if entry is None else np.concatenate([entry.states, new_states])
+    entry = _Entry(states, data[-1, "index"] if rows > 0 else None)
+
+    _remember(key, entry)
+    _save(day, fingerprint, data, entry)
+    return entry
+
+def _is_prefix(entry: _Entry, data: pl.DataFrame) -> bool:
+    # The states are still valid if the readings they were predicted from are the start of the data
+    count = len(entry.states)
+    if count == 0:
+        return True
+    return count <= data.shape[0] and data[count - 1, "index"] == entry.last_index
+
+def _read(day: str, fingerprint: str) -> Optional[_Entry]:
+    saved = day_cache.read_derived(day, get_name(fingerprint))
+    if saved is None or saved.shape[0] == 0:
+        return None
+    return _Entry(saved["state"].to_numpy(), saved[-1, "index"], saved=True)
+
+def _save(day: str, fingerprint: str, data: pl.DataFrame, entry: _Entry) -> None:
+    # Only complete days are saved, the current one gets new readings every few seconds
+    if entry.saved or data.shape[0] == 0 or not day_cache.is_complete(day):
+        return
+    day_cache.write_derived(day, get_name(fingerprint), pl.DataFrame({
+        "index": data["index"],
+        "state": pl.Series(entry.states, dtype=pl.String),
+    }))
+    entry.saved = True
+
+def _remember(key: tuple[str, str], entry: _Entry) -> None:
+    with lock:
+        memory[key] = entry
+        memory.move_to_end(key)
+        while len(memory) > MAX_MEMORY_ENTRIES:
+            memory.popitem(last=False)
@@ -1,39 +1,149 @@
+import hashlib
 import numpy as np
+import os
 import pickle
 import polars as pl
 
-from time import time
 from datetime import date
-from sklearn.ensemble import RandomForestClassifier
+from functools import partial
+from threading import Lock
 from typing import Any, Optional
 
-from modules import database_manager
+from modules import database_manager, features, forest_engine, inference_service, instrumentation, outlier_filter, posture_sessions, prediction_cache
+from modules.single_flight import single_flight
 
 # ===== Cache variables ===== #
-polling_interval = 0.5
-last_read: float = 0.0
 last_data = pl.DataFrame()
 last_state = "Not Sitting"
+# The callbacks run in several threads
+state_lock = Lock()
 
 # ===== Load model ===== #
-with open("model.pkl", "rb") as f:
-    model: RandomForestClassifier = pickle.load(f)
+MODEL_PATH = "model.pkl"
+model: Any = None
+# The model flattened into arrays, faster than sklearn on small batches
+engine: Any = None
+# Hash of the model file, identifies the model in the prediction cache
+model_fingerprint = ""
+model_file_stat: tuple[int, int] = (0, 0)
+model_lock = Lock()
+
+def load_model() -> tuple[Any, Any, str]:
+    """
+    Loads the model, again if the file changed since the last time.
+
+    Returns
+    -------
+    tuple[Any, Any, str]
+        A tuple with the model, its inference engine and its fingerprint.
+    """
+    global model, engine, model_fingerprint, model_file_stat
+    stat = os.stat(MODEL_PATH)
+    with model_lock:
+        if (stat.st_mtime_ns, stat.st_size) != model_file_stat:
+            with open(MODEL_PATH, "rb") as f:
+                content = f.read()
+            model = pickle.loads(content)
+            engine = forest_engine.compile_model(model)
+            model_fingerprint = hashlib.sha256(content).hexdigest()[:16]
+            model_file_stat = (stat.st_mtime_ns, stat.st_size)
+        return model, engine, model_fingerprint
+
+load_model()
 
 # ===== Helper functions ===== #
 def get_model() -> Any:
-    return model
+    return load_model()[0]
+
+def predict_states(current_model: Any, current_engine: Any, data: pl.DataFrame) -> np.ndarray:
+    """
+    Predicts the posture states of the rows of a DataFrame. Small batches go through
+    the inference engine, since sklearn's overhead dominates them, batched with the
+    requests of other callers by the inference service. Large ones go through sklearn,
+    whose compiled loops are faster. Both give the same results.
+
+    The service only waits for other requests, about 5 ms, while other callers are
+    predicting. A single viewer gets its row predicted right away, in about 0.5 ms.
+
+    Parameters
+    ----------
+    current_model : Any
+        The model.
+    current_engine : Any
+        The inference engine of the model.
+    data : polars.DataFrame
+        The sensor data.
+
+    Returns
+    -------
+    numpy.ndarray[str]
+        The states, one per row.
+    """
+    with instrumentation.timed("predict"):
+        values = features.extract_features(data)
+        if data.shape[0] <= forest_engine.SMALL_BATCH:
+            return inference_service.service.predict(current_engine, values)
+        return current_model.predict(values)
+
+def get_states(day: str, data: pl.DataFrame) -> np.ndarray:
+    """
+    Gets the posture states of the data from a day, reusing the cached predictions.
+
+    Parameters
+    ----------
+    day : str
+        The day, in the format YYYY-MM-DD.
+    data : polars.DataFrame
+        The data from the day.
 
-def set_data_polling_interval(interval: float) -> None:
+    Returns
+    -------
+    numpy.ndarray[str]
+        The states, one per row.
+    """
+    current_model, current_engine, fingerprint = load_model()
+    predict = partial(predict_states, current_model, current_engine)
+    return prediction_cache.get_states(day, fingerprint, data, predict)
+
+def get_state_counts(day: str, data: pl.DataFrame) -> dict[str, int]:
+    """
+    Gets the number of rows in each posture state in the data from a day.
+
+    Parameters
+    ----------
+    day : str
+        The day, in the format YYYY-MM-DD.
+    data : polars.DataFrame
+        The data from the day.
+
+    Returns
+    -------
+    dict[str, int]
+        The number of rows by state.
+    """
+    current_model, current_engine, fingerprint = load_model()
+    predict = partial(predict_states, current_model, current_engine)
+    return prediction_cache.get_state_counts(day, fingerprint, data, predict)
+
+def get_session_tracker(day: str, data: pl.DataFrame) -> posture_sessions.PostureSessionTracker:
     """
-    Sets the minimum time to wait before polling the data from the database.
+    Gets the sitting sessions and alerts of the data from a day, from the cached states.
 
     Parameters
     ----------
-    interval : float
-        The interval in seconds.
+    day : str
+        The day, in the format YYYY-MM-DD.
+    data : polars.DataFrame
+        The data from the day.
+
+    Returns
+    -------
+    posture_sessions.PostureSessionTracker
     """
-    global polling_interval
-    polling_interval = interval
+    states = get_states(day, data)
+    fingerprint = load_model()[2]
+    index = data["index"].to_numpy() if data.shape[0] > 0 else np.array([], dtype="datetime64[us]")
+    return posture_sessions.get_tracker(day, fingerprint, index, states)
 
 def get_current_data() -> tuple[str, pl.DataFrame]:
     """
@@ -45,23 +155,27 @@ def get_current_data() -> tuple[str, pl.DataFrame]:
     tuple[str, polars.DataFrame]
         A tuple with the state and the data.
     """
-    global last_read, last_data, last_state, polling_interval
-    now = time()
-    if now - last_read >= polling_interval:
-        last_read = now
-        current_data = database_manager.get_current_data()
-        if current_data.shape[0] == 0:
-            state = ["Not Sitting"]
-        else:
-            state = model.predict(
-                current_data.drop("index").rows(named=False)
-            )
-
-        last_state = state[0]
+    global last_data, last_state
+    current_data = database_manager.get_current_data()
+    with state_lock:
+        # The feed returns the same frame until a new reading arrives, so each one is predicted once
+        if current_data is last_data:
+            return last_state, last_data
+
+    # Predicted without the lock, so the callers of a new reading are batched by the inference service
+    if current_data.shape[0] == 0:
+        state = "Not Sitting"
+    else:
+        current_model, current_engine, _ = load_model()
+        state = predict_states(current_model, current_engine, current_data)[0]
+
+    with state_lock:
+        last_state = state
         last_data = current_data
 
-    return last_state, last_data
+    return state, current_data
 
+@single_flight(ttl=database_manager.DATA_TTL)
 def get_last_active_day_data() -> tuple[date, np.ndarray, pl.DataFrame]:
     """
     Gets data from the last active day and predicts the posture.
@@ -72,15 +186,14 @@ def get_last_active_day_data() -> tuple[date, np.ndarray, pl.DataFrame]:
         A tuple with the date, the predicted states and the DataFrame.
     """
     day, data = database_manager.get_last_active_day_data()
-
-    values = data.drop("index").rows(named=False)
-    states = model.predict(values)
+    states = get_states(str(day), data)
     return day, states, data
 
 def filter_outliers(df: pl.DataFrame, window_size: Optional[int] = 3,
                     threshold: Optional[float] = 1000.0) -> pl.DataFrame:
     """
     Filter outliers from a DataFrame by checking the deviation in consecutive values.
+    Each row is compared with the previous ones, see outlier_filter.
 
     Parameters
     ----------
@@ -96,16 +209,6 @@ def filter_outliers(df: pl.DataFrame, window_size: Optional[int] = 3,
     polars.DataFrame
         Filtered DataFrame.
     """
-    standard_deviations = []
-
-    for j in range(df.shape[1] - 1):
-        standard_deviations.append(df[:, j].rolling_std(window_size))
-
-    variations = pl.DataFrame(standard_deviations).sum(axis=1)
-    # The rolling std considers the previous row for the value of a given row,
-    # so the first ones are null and thus calculated separately
-    for i in range(window_size - 1):
-        # Gets the rows following i and excludes the index
-        variations[i] = df[i : i + window_size - 1, :-1].std().sum(axis=1)
-
-    return df.filter(variations < threshold)
+    # The same mask as the streaming filter of the realtime feed
+    mask = outlier_filter.outlier_mask(features.extract_features(df), window_size, threshold)
+    return df.filter(pl.Series(mask))
@@ -0,0 +1,196 @@
+"""
+This module builds aggregates of a day at a few resolutions, so long periods can be
+charted from a few thousand points instead of every reading. Each level has, for
+every bucket, the number of readings and the min, mean and max of each sensor.
+
+Buckets are aligned to the clock, so a 10 s bucket starts at 12:00:00, 12:00:10...
+Each level is built from the previous one, which gives the same result as building
+it from the readings, and the levels are saved next to the day in the cache. The
+levels of a day still being recorded are kept in memory until it gets new readings.
+"""
+import polars as pl
+
+from datetime import timedelta
+from threading import Lock
+from typing import Optional
+
+from modules import day_cache
+from modules.features import SENSORS
+
+# ===== Settings ===== #
+LEVELS = [1, 10, 60, 600] # Bucket sizes in seconds
+
+# ===== Variables ===== #
+# Levels of the last day still being recorded, with the number of readings and the last time
+recent: tuple[str, int, object, dict[int, pl.DataFrame]] = ("", 0, None, {})
+recent_lock = Lock()
+
+# ===== Helper functions ===== #
+def as_level(data: pl.DataFrame) -> pl.DataFrame:
+    """
+    Converts the readings to the format of the levels, with one bucket per reading.
+
+    Parameters
+    ----------
+    data : polars.DataFrame
+        The readings, with the sensor columns and "index".
+
+    Returns
+    -------
+    polars.DataFrame
+    """
+    return data.select(
+        "index",
+        pl.lit(1, dtype=pl.UInt32).alias("count"),
+        *[pl.col(sensor).alias(f"{sensor}_min") for sensor in SENSORS],
+        *[pl.col(sensor).cast(pl.Float64).alias(f"{sensor}_mean") for sensor in SENSORS],
+        *[pl.col(sensor).alias(f"{sensor}_max") for sensor in SENSORS],
+    )
+
+def aggregate(data: pl.DataFrame, seconds: int) -> pl.DataFrame:
+    """
+    Aggregates the readings, or a finer level, in buckets of the given size.
+
+    Parameters
+    ----------
+    data : polars.DataFrame
+        The readings or a level. Levels must have buckets that divide the new size.
+    seconds : int
+        The size of the buckets.
+
+    Returns
+    -------
+    polars.DataFrame
+        The level, with the buckets labeled by their start.
+    """
+    if "count" not in data.columns:
+        data = as_level(data)
+    count = pl.col("count")
+    return data.sort("index").group_by_dynamic("index", every=f"{seconds}s").agg(
+        count.sum(),
+        *[pl.col(f"{sensor}_min").min() for sensor in SENSORS],
+        # The means of the buckets are weighted by their number of readings
+        *[((pl.col(f"{sensor}_mean") * count).sum() / count.sum()).alias(f"{sensor}_mean") for sensor in SENSORS],
+        *[pl.col(f"{sensor}_max").max() for sensor in SENSORS],
+    )
+
+def build_levels(data: pl.DataFrame) -> dict[int, pl.DataFrame]:
+    """
+    Builds all the levels of a day.
+
+    Parameters
+    ----------
+    data : polars.DataFrame
+        The readings of the day.
+
+    Returns
+    -------
+    dict[int, polars.DataFrame]
+        The levels by their bucket size in seconds.
+    """
+    levels = {}
+    previous = data
+    for seconds in LEVELS:
+        levels[seconds] = aggregate(previous, seconds)
+        previous = levels[seconds]
+    return levels
+
+def get_levels(day: str, data: pl.DataFrame) -> dict[int, pl.DataFrame]:
+    """
+    Gets the levels of a day from the cache, building and saving them if needed.
+    The levels of a day still being recorded are only kept in memory.
+
+    Parameters
+    ----------
+    day : str
+        The day, in the format YYYY-MM-DD.
+    data : polars.DataFrame
+        The readings of the day, used if the levels aren't cached.
+
+    Returns
+    -------
+    dict[int, polars.DataFrame]
+        The levels by their bucket size in seconds, or an empty dict if there's no data.
+    """
+    if data.shape[0] == 0:
+        return {}
+
+    global recent
+    if not day_cache.is_complete(day):
+        key = (day, data.shape[0], data[-1, "index"])
+        with recent_lock:
+            # Built again only once readings were added to the day
+            if recent[:3] == key:
+                return recent[3]
+        # Built without the lock, concurrent callers may build the same levels
+        levels = build_levels(data)
+        with recent_lock:
+            recent = (*key, levels)
+        return levels
+
+    levels = {seconds: day_cache.read_derived(day, f"{seconds}s") for seconds in LEVELS}
+    if all(level is not None for level in levels.values()):
+        return levels
+
+    levels = build_levels(data)
+    for seconds, level in levels.items():
+        day_cache.write_derived(day, f"{seconds}s", level)
+    return levels
+
+def level_for_width(span: timedelta, width: int) -> Optional[int]:
+    """
+    Gets the coarsest level that still has a bucket per pixel.
+
+    Parameters
+    ----------
+    span : datetime.timedelta
+        The time covered by the chart.
+    width : int
+        The width of the chart in pixels.
+
+    Returns
+    -------
+    int | None
+        The bucket size of the level, or None if the readings should be used.
+    """
+    seconds = span.total_seconds() / max(width, 1)
+    candidates = [level for level in LEVELS if level <= seconds]
+    return max(candidates) if len(candidates) > 0 else None
+
+def level_for_granularity(granularity: int) -> Optional[int]:
+    """
+    Gets the coarsest level whose buckets fit exactly in intervals of the given size.
+
+    Parameters
+    ----------
+    granularity : int
+        The size of the intervals in seconds.
+
+    Returns
+    -------
+    int | None
+        The bucket size of the level, or None if the readings should be used.
+    """
+    candidates = [level for level in LEVELS if granularity % level == 0]
+    return max(candidates) if len(candidates) > 0 else None
+
+def select(levels: dict[int, pl.DataFrame], data: pl.DataFrame, seconds: Optional[int]) -> pl.DataFrame:
+    """
+    Gets a level, or the readings in the format of the levels if there's no such level.
+
+    Parameters
+    ----------
+    levels : dict[int, polars.DataFrame]
+        The levels of the data.
+    data : polars.DataFrame
+        The readings.
+    seconds : int | None
+        The bucket size of the level.
+
+    Returns
+    -------
+    polars.DataFrame
+    """
+    if seconds is None or seconds not in levels:
+        return as_level(data)
+    return levels[seconds]
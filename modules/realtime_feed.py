@@ -0,0 +1,134 @@
+"""
+This module keeps the latest readings of the sensors in memory. A background
+subscription to the current day of the storage backend decodes each new reading
+once, as it arrives, and keeps the last ones in a bounded ring buffer, so the
+callbacks read them without waiting for the database.
+"""
+import polars as pl
+
+from collections import deque
+from datetime import date
+from threading import Lock
+from typing import Any, Callable, Optional
+
+from modules import features, instrumentation
+from modules.outlier_filter import OutlierFilter
+from modules.storage_backend import StorageBackend
+
+# ===== Settings ===== #
+CAPACITY = 120 # Number of readings kept, one minute at the sensor rate
+
+class RealtimeFeed:
+    """
+    Subscription to the readings of the current day, restarted when the day changes.
+
+    Parameters
+    ----------
+    backend : StorageBackend
+        The backend where the readings are saved.
+    decode : Callable[[dict[str, Any]], polars.DataFrame]
+        Function that converts the records to a DataFrame with an "index" column.
+    capacity : int, optional
+        The number of readings kept, by default CAPACITY.
+    outlier_filter : OutlierFilter, optional
+        Filter that drops the outliers as they arrive, by default None.
+    """
+
+    def __init__(self, backend: StorageBackend,
+                 decode: Callable[[dict[str, Any]], pl.DataFrame],
+                 capacity: int = CAPACITY,
+                 outlier_filter: Optional[OutlierFilter] = None):
+        self.backend = backend
+        self.decode = decode
+        self.outlier_filter = outlier_filter
+        # Appending to and reading the end of a deque are atomic, so readers don't lock
+        self.frames: deque[pl.DataFrame] = deque(maxlen=capacity)
+        self.day = ""
+        self.last_key: Optional[str] = None
+        self.unsubscribe: Optional[Callable[[], None]] = None
+        self.lock = Lock()
+
+    def start(self) -> None:
+        """Subscribes to the current day, if it's not already subscribed."""
+        day = str(date.today())
+        if day == self.day:
+            return
+        with self.lock:
+            if day == self.day:
+                return
+            self.stop()
+            self.frames.clear()
+            if self.outlier_filter is not None:
+                self.outlier_filter.reset()
+            # Start from the last readings instead of the whole day
+            with instrumentation.timed("storage_read"):
+                records = self.backend.get_tail(day, limit=self.frames.maxlen)
+            self.last_key = max(records.keys()) if len(records) > 0 else None
+            self._append(records)
+            self.unsubscribe = self.backend.subscribe(day, self._on_records, start_after=self.last_key)
+            self.day = day
+
+    def stop(self) -> None:
+        """Ends the subscription."""
+        if self.unsubscribe is not None:
+            self.unsubscribe()
+            self.unsubscribe = None
+        self.day = ""
+
+    def latest(self) -> pl.DataFrame:
+        """
+        Gets the latest reading, subscribing again first if the day changed.
+
+        Returns
+        -------
+        polars.DataFrame
+            A one-row DataFrame, or an empty one if there are no readings.
+        """
+        self.start()
+        try:
+            return self.frames[-1]
+        except IndexError:
+            return pl.DataFrame()
+
+    def recent(self, count: Optional[int] = None) -> pl.DataFrame:
+        """
+        Gets the latest readings kept in the buffer.
+
+        Parameters
+        ----------
+        count : int, optional
+            The maximum number of readings, by default all the buffer.
+
+        Returns
+        -------
+        polars.DataFrame
+            The readings sorted by time, or an empty DataFrame if there are none.
+        """
+        self.start()
+        frames = list(self.frames)
+        if count is not None:
+            frames = frames[-count:] if count > 0 else []
+        if len(frames) == 0:
+            return pl.DataFrame()
+        return pl.concat(frames)
+
+    def _on_records(self, records: dict[str, Any]) -> None:
+        # Backends may send records already read, such as Firebase when it reconnects
+        if self.last_key is not None:
+            records = {key: value for key, value in records.items() if key > self.last_key}
+        if len(records) == 0:
+            return
+        self.last_key = max(records.keys())
+        self._append(records)
+
+    def _append(self, records: dict[str, Any]) -> None:
+        if len(records) == 0:
+            return
+        # Only the readings that fit in the buffer are decoded
+        keys = sorted(records)[-self.frames.maxlen:]
+        data = self.decode({key: records[key] for key in keys})
+        if self.outlier_filter is not None:
+            # Same mask as predictor.filter_outliers on the same readings
+            values = features.extract_features(data)
+            data = data.filter(pl.Series([self.outlier_filter.update(row) for row in values]))
+        self.frames.extend(data.iter_slices(1))
@@ -0,0 +1,143 @@
+"""
+This module coalesces concurrent identical requests. While a call is in flight,
+other threads asking for the same key wait for it and share its result instead
+of repeating it, and the result is then kept for a short time. The expired results
+are dropped on every call, in the order they expire, so a result such as the data of
+a day isn't kept for the life of the process once nobody asks for it.
+"""
+import heapq
+
+from functools import wraps
+from threading import Event, Lock
+from time import monotonic
+from typing import Any, Callable, Hashable, Optional
+
+class _Call:
+    """A call in flight, which the waiting threads read once it's done."""
+
+    def __init__(self):
+        self.done = Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+class SingleFlight:
+    """
+    Runs a function once for the concurrent calls with the same key.
+
+    Parameters
+    ----------
+    ttl : float, optional
+        The time in seconds the results are reused for, by default 0.
+        Errors are never reused.
+    """
+
+    def __init__(self, ttl: float = 0.0):
+        self.ttl = ttl
+        self.lock = Lock()
+        self.calls: dict[Hashable, _Call] = {}
+        self.results: dict[Hashable, tuple[float, Any]] = {}
+        # Expiration times of the results, with a counter so the keys are never compared
+        self.expirations: list[tuple[float, int, Hashable]] = []
+        self.counter = 0
+
+    def do(self, key: Hashable, function: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Calls the function, unless there's a call with the same key in flight
+        or a recent result, which are used instead.
+
+        Parameters
+        ----------
+        key : Hashable
+            The key identifying the request.
+        function : Callable
+            The function that makes the request.
+        *args, **kwargs
+            The arguments of the function.
+
+        Returns
+        -------
+        Any
+            The result of the function.
+        """
+        with self.lock:
+            self._sweep(monotonic())
+            if key in self.results:
+                return self.results[key][1]
+            call = self.calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self.calls[key] = _Call()
+
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function(*args, **kwargs)
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+                if call.error is None and self.ttl > 0:
+                    expiration = monotonic() + self.ttl
+                    self.results[key] = (expiration, call.result)
+                    heapq.heappush(self.expirations, (expiration, self.counter, key))
+                    self.counter += 1
+            call.done.set()
+        return call.result
+
+    def forget(self, key: Optional[Hashable] = None) -> None:
+        """
+        Discards the recent result of a key, so the next call runs the function.
+
+        Parameters
+        ----------
+        key : Hashable, optional
+            The key. If not given, all the results are discarded.
+        """
+        with self.lock:
+            if key is None:
+                self.results.clear()
+                self.expirations.clear()
+            else:
+                # Its expiration is skipped by _sweep
+                self.results.pop(key, None)
+
+    def _sweep(self, now: float) -> None:
+        # Called with the lock held
+        while len(self.expirations) > 0 and self.expirations[0][0] <= now:
+            expiration, _, key = heapq.heappop(self.expirations)
+            # The key may have a newer result, or none if it was forgotten
+            if key in self.results and self.results[key][0] == expiration:
+                del self.results[key]
+
+def single_flight(ttl: float = 0.0) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """
+    Decorator that coalesces the concurrent calls of a function with the same arguments.
+    The SingleFlight used is available as the attribute group of the decorated function.
+
+    Parameters
+    ----------
+    ttl : float, optional
+        The time in seconds the results are reused for, by default 0.
+
+    Returns
+    -------
+    Callable
+    """
+    def decorator(function: Callable[..., Any]) -> Callable[..., Any]:
+        group = SingleFlight(ttl)
+
+        @wraps(function)
+        def wrapper(*args, **kwargs) -> Any:
+            key = (args, tuple(sorted(kwargs.items())))
+            return group.do(key, function, *args, **kwargs)
+
+        wrapper.group = group
+        return wrapper
+
+    return decorator
@@ -0,0 +1,247 @@
+"""
+This module abstracts where the sensor data is stored. The data is organized as
+days (YYYY-MM-DD), each with records keyed by their unix time in milliseconds,
+under a root path such as "fake_data_base64".
+
+The backend is selected with environment variables:
+    SMARTCHAIR_STORAGE: "firebase" (default) or "local"
+    SMARTCHAIR_LOCAL_DATABASE: SQLite file used by the local backend,
+        by default "smartchair.sqlite3" (":memory:" keeps it in memory)
+"""
+import firebase_admin
+import json
+import os
+import sqlite3
+
+from abc import ABC, abstractmethod
+from firebase_admin import credentials
+from firebase_admin import db
+from threading import Event, Lock, Thread
+from typing import Any, Callable, Optional
+
+# ===== Settings ===== #
+STORAGE = os.environ.get("SMARTCHAIR_STORAGE", "firebase")
+LOCAL_DATABASE = os.environ.get("SMARTCHAIR_LOCAL_DATABASE", "smartchair.sqlite3")
+
+# Interval in seconds used by the backends that poll for new records
+POLLING_INTERVAL = 0.1
+
+FIREBASE_CREDENTIALS = "serviceAccountKey.json"
+FIREBASE_URL = "https://friendly-bazaar-334818-default-rtdb.firebaseio.com"
+
+backends: dict[str, "StorageBackend"] = {}
+backends_lock = Lock()
+firebase_lock = Lock()
+
+# ===== Backends ===== #
+class StorageBackend(ABC):
+    """
+    Interface of the storage backends. Keys are sorted as strings, which matches
+    the time order since every key has 13 digits.
+    """
+
+    @abstractmethod
+    def list_days(self) -> list[str]:
+        """Returns the days that have data."""
+
+    @abstractmethod
+    def get_keys(self, day: str) -> list[str]:
+        """Returns the sorted keys of a day, without the records."""
+
+    @abstractmethod
+    def get_day(self, day: str) -> Optional[dict[str, Any]]:
+        """Returns the records of a day, or None if there's no data."""
+
+    @abstractmethod
+    def get_tail(self, day: str, start_after: Optional[str] = None,
+                 limit: Optional[int] = None) -> dict[str, Any]:
+        """
+        Returns the records of a day sorted by key.
+
+        Parameters
+        ----------
+        day : str
+            The day, in the format YYYY-MM-DD.
+        start_after : str, optional
+            If given, only the records after this key are returned.
+        limit : int, optional
+            If given, only the last records are returned.
+        """
+
+    @abstractmethod
+    def push(self, day: str, key: str, value: Any) -> None:
+        """Saves a record, replacing the one with the same key if there's one."""
+
+    def subscribe(self, day: str, callback: Callable[[dict[str, Any]], None],
+                  start_after: Optional[str] = None) -> Callable[[], None]:
+        """
+        Calls the callback from a background thread with the new records of a day,
+        sorted by key, as they're saved. By default the day is polled every
+        POLLING_INTERVAL seconds.
+
+        Parameters
+        ----------
+        day : str
+            The day, in the format YYYY-MM-DD.
+        callback : Callable[[dict[str, Any]], None]
+            The function that receives the new records.
+        start_after : str, optional
+            If given, only the records after this key are sent.
+
+        Returns
+        -------
+        Callable[[], None]
+            A function that ends the subscription.
+        """
+        stop = Event()
+
+        def poll() -> None:
+            last_key = start_after
+            while not stop.wait(POLLING_INTERVAL):
+                records = self.get_tail(day, start_after=last_key)
+                if len(records) > 0:
+                    last_key = max(records.keys())
+                    callback(records)
+
+        Thread(target=poll, daemon=True).start()
+        return stop.set
+
+class FirebaseBackend(StorageBackend):
+    """Backend using the Firebase Realtime Database."""
+
+    def __init__(self, root: str):
+        get_firebase_app()
+        self.root_ref = db.reference(root)
+
+    def list_days(self) -> list[str]:
+        return list((self.root_ref.get(shallow=True) or {}).keys())
+
+    def get_keys(self, day: str) -> list[str]:
+        return sorted((self.root_ref.child(day).get(shallow=True) or {}).keys())
+
+    def get_day(self, day: str) -> Optional[dict[str, Any]]:
+        return self.root_ref.child(day).get()
+
+    def get_tail(self, day: str, start_after: Optional[str] = None,
+                 limit: Optional[int] = None) -> dict[str, Any]:
+        query = self.root_ref.child(day).order_by_key()
+        if start_after is not None:
+            query = query.start_at(start_after)
+        if limit is not None:
+            # The start of the query is inclusive, so one more record is requested in its place
+            query = query.limit_to_last(limit + 1 if start_after is not None else limit)
+        result = query.get() or {}
+        result.pop(start_after, None)
+        if limit is not None and len(result) > limit:
+            result = {key: result[key] for key in sorted(result)[-limit:]}
+        return result
+
+    def push(self, day: str, key: str, value: Any) -> None:
+        self.root_ref.child(day).child(key).set(value)
+
+    def subscribe(self, day: str, callback: Callable[[dict[str, Any]], None],
+                  start_after: Optional[str] = None) -> Callable[[], None]:
+        # Firebase sends the whole day when listening starts, then every new child
+        def listener(event: db.Event) -> None:
+            if event.data is None:
+                return
+            path = event.path.strip("/")
+            if path == "":
+                records = event.data
+            elif "/" not in path:
+                records = {path: event.data}
+            else:
+                return
+            records = {key: records[key] for key in sorted(records) if start_after is None or key > start_after}
+            if len(records) > 0:
+                callback(records)
+
+        registration = self.root_ref.child(day).listen(listener)
+        return registration.close
+
+class LocalBackend(StorageBackend):
+    """Backend using a local SQLite database, for tests and benchmarks without network."""
+
+    def __init__(self, root: str, path: str = LOCAL_DATABASE):
+        self.root = root
+        self.lock = Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS records ("
+                "root TEXT, day TEXT, key TEXT, value TEXT, PRIMARY KEY (root, day, key)"
+                ") WITHOUT ROWID"
+            )
+
+    def _query(self, sql: str, parameters: tuple) -> list[tuple]:
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def list_days(self) -> list[str]:
+        rows = self._query("SELECT DISTINCT day FROM records WHERE root = ? ORDER BY day", (self.root,))
+        return [day for day, in rows]
+
+    def get_keys(self, day: str) -> list[str]:
+        rows = self._query("SELECT key FROM records WHERE root = ? AND day = ? ORDER BY key", (self.root, day))
+        return [key for key, in rows]
+
+    def get_day(self, day: str) -> Optional[dict[str, Any]]:
+        return self.get_tail(day) or None
+
+    def get_tail(self, day: str, start_after: Optional[str] = None,
+                 limit: Optional[int] = None) -> dict[str, Any]:
+        sql = "SELECT key, value FROM records WHERE root = ? AND day = ? AND key > ? ORDER BY key DESC"
+        parameters = (self.root, day, start_after or "")
+        if limit is not None:
+            sql += " LIMIT ?"
+            parameters += (limit,)
+        rows = self._query(sql, parameters)
+        return {key: json.loads(value) for key, value in reversed(rows)}
+
+    def push(self, day: str, key: str, value: Any) -> None:
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?)",
+                (self.root, day, key, json.dumps(value))
+            )
+
+# ===== Helper functions ===== #
+def get_firebase_app() -> firebase_admin.App:
+    """
+    Gets the default Firebase app, initializing it on the first call.
+
+    Returns
+    -------
+    firebase_admin.App
+    """
+    with firebase_lock:
+        try:
+            return firebase_admin.get_app()
+        except ValueError:
+            cred = credentials.Certificate(FIREBASE_CREDENTIALS)
+            return firebase_admin.initialize_app(cred, options={"databaseURL": FIREBASE_URL})
+
+def get_backend(root: str) -> StorageBackend:
+    """
+    Gets the configured storage backend for a root path, creating it on the first call.
+
+    Parameters
+    ----------
+    root : str
+        The root path of the data, such as "fake_data_base64".
+
+    Returns
+    -------
+    StorageBackend
+    """
+    root = root.strip("/")
+    with backends_lock:
+        if root not in backends:
+            match STORAGE:
+                case "firebase":
+                    backends[root] = FirebaseBackend(root)
+                case "local":
+                    backends[root] = LocalBackend(root)
+                case _:
+                    raise ValueError(f"Unknown storage backend: {STORAGE}")
+        return backends[root]
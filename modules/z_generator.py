@@ -1,7 +1,19 @@
 """
 This module generates the z layer for the contour plot. It is capable of
 plotting the sensor data according to the sensor"s position on the chair.
+
+The grids are NumPy arrays, with NaN for the points left for interpolation. The
+cells of the 3x3 stamp of each sensor are precomputed as indices of the seat and
+backrest grids stacked, so a frame is a copy of the base and a single scatter-max.
+
+The gaps are filled on the server by inverse distance weighting from the cells with
+a value, the stamps and the border. It's linear in the values of the sensors, so
+it's precomputed as a matrix, and the maps of a batch of frames are one product.
+
+Running the module checks generate_z against the previous implementation and the
+interpolation against the stamps, and times both.
 """
+import numpy as np
 import polars as pl
 
 from copy import deepcopy
@@ -53,11 +65,157 @@ def is_back_point(key: str) -> bool:
     """
     return int(key[1:]) < 4
 
-def generate_z(data: pl.DataFrame) -> tuple[list[list[int]]]:
+# Base grids, seat and backrest stacked, with the border and the stamps set to 0.
+# The stamps take the max of the values and 0, as the cells without a value count as 0
+grids_base = np.array([z_base, z_base], dtype=np.float64)
+# Flat indices of the 3x3 stamp of each sensor in the stacked grids
+stamps = {}
+for key, point in points.items():
+    rows, columns = np.meshgrid(np.arange(point[0] - 1, point[0] + 2),
+                                np.arange(point[1] - 1, point[1] + 2), indexing="ij")
+    stamps[key] = np.ravel_multi_index((np.full(9, int(is_back_point(key))), rows.ravel(), columns.ravel()),
+                                       grids_base.shape)
+    grids_base.flat[stamps[key]] = 0
+
+def get_stamp_indices(columns: list[str]) -> np.ndarray:
+    """
+    Gets the indices of the stamps of the sensors in the stacked grids.
+
+    Parameters
+    ----------
+    columns : list[str]
+        The sensors, in the order of the values.
+
+    Returns
+    -------
+    numpy.ndarray
+        The indices, with shape (sensors, 9).
+    """
+    return np.stack([stamps[key] for key in columns])
+
+def generate_z(data: pl.DataFrame) -> tuple[np.ndarray, np.ndarray]:
     """
     Generates the z layer for the contour plot by marking points
     as 3x3 spaces on the plot, leaving the rest for interpolation.
 
+    Parameters
+    ----------
+    data : pl.DataFrame
+        The data to be plotted, only the first row is used.
+
+    Returns
+    -------
+    tuple[numpy.ndarray, numpy.ndarray]
+        The z layers for the contour plot: seat and backrest, respectively.
+        The points left for interpolation are NaN.
+    """
+    indices = get_stamp_indices(data.columns)
+    values = np.asarray(data.row(0), dtype=np.float64)
+
+    z = grids_base.copy()
+    # Overlapping stamps keep the largest value
+    np.maximum.at(z.reshape(-1), indices, values[:, np.newaxis])
+    return z[0], z[1]
+
+# ===== Interpolation ===== #
+IDW_POWER = 2
+
+def build_interpolation_operator(power: float = IDW_POWER) -> np.ndarray:
+    """
+    Builds the matrix that maps the values of the sensors to the interpolated grids.
+    The stamps take the value of their sensor, the border is 0 and every other cell
+    is the average of the cells with a value of its grid, weighted by the inverse
+    of their distance to the power.
+
+    Parameters
+    ----------
+    power : float, optional
+        The power of the distances, by default IDW_POWER.
+
+    Returns
+    -------
+    numpy.ndarray
+        The operator, with shape (sensors, cells of both grids stacked).
+    """
+    sensors = list(coords.keys())
+    operator = np.zeros((len(sensors), grids_base.size))
+    # The sensor of each cell with a value, -1 for the border and -2 for the gaps
+    owner = np.where(np.isnan(grids_base.reshape(-1)), -2, -1)
+    for i, key in enumerate(sensors):
+        owner[stamps[key]] = i
+        operator[i, stamps[key]] = 1
+
+    layer, row, column = np.unravel_index(np.arange(grids_base.size), grids_base.shape)
+    for current in range(grids_base.shape[0]):
+        known = np.flatnonzero((layer == current) & (owner != -2))
+        unknown = np.flatnonzero((layer == current) & (owner == -2))
+        distances = np.hypot(row[unknown, np.newaxis] - row[known], column[unknown, np.newaxis] - column[known])
+        weights = distances ** -power
+        weights /= weights.sum(axis=1, keepdims=True)
+        # The border has value 0, so only the weights of the stamps are kept
+        for i in np.unique(owner[known]):
+            if i >= 0:
+                operator[i, unknown] = weights[:, owner[known] == i].sum(axis=1)
+    return operator
+
+interpolation_operator = build_interpolation_operator()
+
+def interpolate_batch(values: np.ndarray) -> np.ndarray:
+    """
+    Interpolates the grids of a batch of frames.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        The values of the sensors, with shape (frames, sensors) in the order of coords.
+
+    Returns
+    -------
+    numpy.ndarray
+        The grids, with shape (frames, 2, rows, columns), seat and backrest respectively.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    return (values @ interpolation_operator).reshape(values.shape[0], *grids_base.shape)
+
+def interpolate_frames(values: np.ndarray) -> np.ndarray:
+    """
+    Interpolates the grids of a batch of frames in a compact format, to be sent to the clients.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        The values of the sensors, with shape (frames, sensors) in the order of coords.
+
+    Returns
+    -------
+    numpy.ndarray[uint16]
+        The grids rounded to integers, with shape (frames, 2, rows, columns).
+    """
+    # The weights of each cell sum to at most 1, so the grids stay in the range of the sensors
+    return np.rint(interpolate_batch(values)).astype(np.uint16)
+
+def interpolate(data: pl.DataFrame) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Generates the z layers for the contour plot, interpolated between the sensors.
+
+    Parameters
+    ----------
+    data : pl.DataFrame
+        The data to be plotted, only the first row is used.
+
+    Returns
+    -------
+    tuple[numpy.ndarray, numpy.ndarray]
+        The z layers for the contour plot: seat and backrest, respectively.
+    """
+    values = np.asarray(data.select(list(coords.keys())).row(0), dtype=np.float64)
+    z = interpolate_batch(values[np.newaxis])[0]
+    return z[0], z[1]
+
+def _generate_z_reference(data: pl.DataFrame) -> tuple[list[list[int]]]:
+    """
+    The previous implementation of generate_z, with nested lists, kept to check the results.
+
     Parameters
     ----------
     data : pl.DataFrame
@@ -86,9 +244,36 @@ def generate_z(data: pl.DataFrame) -> tuple[list[list[int]]]:
     return z
 
 if __name__ == "__main__":
-    # Uses a dictionary to simulate the data
-    z = generate_z({
-        "p00": 1, "p01": 2, "p02": 3, "p03": 4, "p04": 5, "p05": 6,
-        "p06": 7,"p07": 8, "p08": 9, "p09": 10, "p10": 11, "p11": 12
-    })
-    print(z)
+    from timeit import timeit
+
+    rng = np.random.default_rng(0)
+    columns = list(coords.keys())
+
+    # Both implementations give the same grids, with None as NaN
+    for _ in range(1000):
+        frame = pl.DataFrame({key: [int(value)] for key, value in zip(columns, rng.integers(0, 4096, 12))})
+        expected = _generate_z_reference(frame)
+        result = generate_z(frame)
+        for layer in range(2):
+            reference = np.array(expected[layer], dtype=np.float64)
+            assert np.array_equal(result[layer], reference, equal_nan=True)
+    print("generate_z matches the reference")
+
+    number = 2000
+    reference_time = timeit(lambda: _generate_z_reference(frame), number=number) / number
+    numpy_time = timeit(lambda: generate_z(frame), number=number) / number
+    print(f"Reference: {reference_time * 1e6:.1f} us per frame")
+    print(f"NumPy: {numpy_time * 1e6:.1f} us per frame ({reference_time / numpy_time:.1f}x)")
+
+    # The interpolation keeps the cells with a value
+    z = generate_z(frame)
+    interpolated = interpolate(frame)
+    for layer in range(2):
+        known = ~np.isnan(z[layer])
+        assert np.allclose(interpolated[layer][known], z[layer][known])
+        assert not np.isnan(interpolated[layer]).any()
+
+    values = rng.integers(0, 4096, (1000, 12))
+    batch_time = timeit(lambda: interpolate_batch(values), number=20) / 20
+    print(f"Interpolation: {timeit(lambda: interpolate(frame), number=number) / number * 1e6:.1f} us per frame, "
+          f"{batch_time * 1e3:.1f} ms per batch of 1000 frames")
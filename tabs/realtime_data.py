@@ -4,44 +4,43 @@ import plotly.graph_objects as go
 import plotly.express as px
 import polars as pl
 
-from dash import dcc, html, Input, Output
-from datetime import datetime
+from dash import ClientsideFunction, dcc, html, no_update, Input, Output, Patch, State
+from typing import Optional
 from plotly.subplots import make_subplots
-from modules import predictor
+from modules import instrumentation, playback, predictor
 from modules.base_app import app
-from modules.z_generator import points, is_back_point, generate_z
+from modules.features import SENSORS
+from modules.history_buffer import HistoryBuffer
+from modules.z_generator import points, is_back_point, grids_base
 
 # ===== Low RAM mode ===== #
 LOWRAM = True
 
 # ===== Variables ===== #
-data_history = {}
+# Latest readings of the chair, shared by the viewers
+history = HistoryBuffer(len(SENSORS))
 
 # ===== Helper functions ===== #
-def create_contour_graph(data: pl.DataFrame) -> go.Figure:
+def create_contour_skeleton() -> go.Figure:
     """
     Creates a figure with two heatmaps representing the posture for
-    the seat and backrest, respectively.
-
-    Parameters
-    ----------
-    data : polars.DataFrame
-        The data to use.
+    the seat and backrest, respectively, without data. The heatmaps are
+    filled in the browser from the values of the sensors.
 
     Returns
     -------
     plotly.graph_objects.Figure
         The figure with the graph.
     """
-    z = generate_z(data.drop("index"))
+    z = np.zeros(grids_base.shape[1:])
     label = dict(font_size=14)
     contours = dict(start=0, end=4608, showlines= False)
     template = "Value: %{z:.2f}<extra></extra>"
 
     fig = make_subplots(rows=1, cols=2, subplot_titles=("Seat", "Backrest"))
-    fig.add_trace(go.Contour(z=z[0], connectgaps=True, contours=contours, hoverlabel=label,
+    fig.add_trace(go.Contour(z=z, contours=contours, hoverlabel=label,
                                 colorscale="Blues", hovertemplate=template), row=1, col=1)
-    fig.add_trace(go.Contour(z=z[1], connectgaps=True, contours=contours, hoverlabel=label,
+    fig.add_trace(go.Contour(z=z, contours=contours, hoverlabel=label,
                                 colorscale="Blues", hovertemplate=template), row=1, col=2)
 
     fig.update_xaxes(showticklabels=False)
@@ -53,9 +52,9 @@ def create_contour_graph(data: pl.DataFrame) -> go.Figure:
 
     return fig
 
-def create_unbalance_graph(data: pl.DataFrame) -> go.Figure:
+def get_reading(data: pl.DataFrame) -> dict[str, object]:
     """
-    Quantifies how assymetric the seat and backrest are.
+    Gets what the browser needs to draw the heatmaps of a reading.
 
     Parameters
     ----------
@@ -64,13 +63,14 @@ def create_unbalance_graph(data: pl.DataFrame) -> go.Figure:
 
     Returns
     -------
-    plotly.graph_objects.Figure
-        The figure with the graph.
+    dict[str, object]
+        The values of the sensors, in the order of the interpolation operator, and
+        the address of the operator.
     """
-    if LOWRAM:
-        return None
+    return {"values": list(data.select(SENSORS).row(0)), "operator": playback.OPERATOR_ROUTE}
 
-    asymmetry_data = {
+def get_asymmetry(data: pl.DataFrame) -> dict[str, float]:
+    return {
         "F - seat top": data[0, 10] - data[0, 11],
         "E - seat top-mid": data[0, 8] - data[0, 9],
         "D - seat bottom-mid": data[0, 6] - data[0, 7],
@@ -78,25 +78,56 @@ def create_unbalance_graph(data: pl.DataFrame) -> go.Figure:
         "B - backrest top": data[0, 2] - data[0, 3],
         "A - backrest bottom": data[0, 0] - data[0, 1]
     }
-    color_list = np.where(np.array(list(asymmetry_data.values())) > 0, "#2986EB", "#EB6963")
-    fig = px.bar(x=list(asymmetry_data.values()), y=list(asymmetry_data.keys()), orientation="h")
+
+def create_unbalance_skeleton() -> go.Figure:
+    """
+    Creates the graph of how assymetric the seat and backrest are, without data.
+
+    Returns
+    -------
+    plotly.graph_objects.Figure
+        The figure with the graph.
+    """
+    if LOWRAM:
+        return None
+
+    parts = list(get_asymmetry(pl.DataFrame([[0] * len(SENSORS)], schema=SENSORS, orient="row")).keys())
+    fig = px.bar(x=[0] * len(parts), y=parts, orientation="h")
     fig.update_layout(title_text="Pressure Asymmetry",
                     xaxis_title="Left - Right",
                     yaxis_title="Part of seat",
                     xaxis=dict(range=[-512, 512]),
                     showlegend=False)
-    fig.update_traces(marker_color=color_list)
     return fig
 
-def create_bar_graph(data: pl.DataFrame) -> go.Figure:
+def update_unbalance_graph(data: pl.DataFrame) -> Patch:
     """
-    Creates a bar graph with the pressure data.
+    Quantifies how assymetric the seat and backrest are.
 
     Parameters
     ----------
     data : polars.DataFrame
         The data to use.
 
+    Returns
+    -------
+    dash.Patch
+        The update of the bars of the graph.
+    """
+    if LOWRAM:
+        return no_update
+
+    asymmetry_data = get_asymmetry(data)
+    color_list = np.where(np.array(list(asymmetry_data.values())) > 0, "#2986EB", "#EB6963")
+    patch = Patch()
+    patch["data"][0]["x"] = list(asymmetry_data.values())
+    patch["data"][0]["marker"]["color"] = color_list.tolist()
+    return patch
+
+def create_bar_skeleton() -> go.Figure:
+    """
+    Creates a bar graph for the pressure data, without data.
+
     Returns
     -------
     plotly.graph_objects.Figure
@@ -106,7 +137,7 @@ def create_bar_graph(data: pl.DataFrame) -> go.Figure:
         return None
 
     fig = go.Figure()
-    fig.add_trace(go.Bar(x=data.columns, y=data.row(0), name="Pressure"))
+    fig.add_trace(go.Bar(x=SENSORS, y=[0] * len(SENSORS), name="Pressure"))
     fig.update_layout(title_text="Pressure Data",
                     xaxis_title="Sensor",
                     yaxis_title="Pressure",
@@ -114,15 +145,32 @@ def create_bar_graph(data: pl.DataFrame) -> go.Figure:
                     showlegend=True)
     return fig
 
-def create_line_graph(data: pl.DataFrame) -> go.Figure:
+def update_bar_graph(data: pl.DataFrame) -> Patch:
     """
-    Creates a line graph with the pressure data along the time.
+    Updates the bar graph with the pressure data.
 
     Parameters
     ----------
     data : polars.DataFrame
         The data to use.
 
+    Returns
+    -------
+    dash.Patch
+        The update of the bars of the graph.
+    """
+    if LOWRAM:
+        return no_update
+
+    patch = Patch()
+    patch["data"][0]["y"] = list(data.select(SENSORS).row(0))
+    return patch
+
+def create_line_skeleton() -> go.Figure:
+    """
+    Creates a line graph for the pressure data along the time, without data.
+    The readings are added by extending the traces, see update_line_graph.
+
     Returns
     -------
     plotly.graph_objects.Figure
@@ -131,24 +179,10 @@ def create_line_graph(data: pl.DataFrame) -> go.Figure:
     if LOWRAM:
         return None
 
-    # If there"s new data
-    if data.shape[0] > 0:
-        # Save the data in the history
-        if len(data_history) == 0:
-            for key in data.columns:
-                data_history[key] = []
-            data_history["time"] = []
-        for key in data.columns:
-            data_history[key].append(data[key][0])
-        data_history["time"].append(datetime.now())
-
-    # Create the figure
     fig = go.Figure()
-    for key in data_history.keys():
-        if key != "time":
-            fig.add_trace(go.Scatter(x=data_history["time"], y=data_history[key], name=key))
+    for key in SENSORS:
+        fig.add_trace(go.Scatter(x=[], y=[], name=key))
 
-    # Update the layout
     fig.update_layout(title_text="Pressure Data",
                     xaxis_title="Time",
                     yaxis_title="Pressure",
@@ -157,63 +191,89 @@ def create_line_graph(data: pl.DataFrame) -> go.Figure:
 
     return fig
 
+def update_line_graph(data: pl.DataFrame, cursor: Optional[int]) -> tuple:
+    """
+    Saves the reading in the history and gets the readings a viewer hasn't got yet.
+
+    Parameters
+    ----------
+    data : polars.DataFrame
+        The data to use, may be empty.
+    cursor : int, optional
+        The time of the last reading sent to the viewer, in milliseconds since the epoch.
+
+    Returns
+    -------
+    tuple
+        The extension of the traces of the graph, with the readings after the cursor,
+        and the new cursor.
+    """
+    if LOWRAM:
+        return no_update, no_update
+
+    if data.shape[0] > 0:
+        time = data.select(pl.col("index").cast(pl.Datetime("ms")).to_physical()).item()
+        history.append(time, np.asarray(data.select(SENSORS).row(0), dtype=np.float64))
+
+    times, values = history.since(cursor)
+    if times.shape[0] == 0:
+        return no_update, no_update
+
+    x = np.datetime_as_string(times.astype("datetime64[ms]")).tolist()
+    extension = {"x": [x] * len(SENSORS), "y": values.T.tolist()}
+    # The graph drops the oldest points, so it never has more than the history
+    return [extension, list(range(len(SENSORS))), history.times.shape[0]], int(times[-1])
+
+# ===== Figure skeletons ===== #
+# The static parts of the figures are built once, the callbacks only send the data
+contour_skeleton = create_contour_skeleton()
+unbalance_skeleton = create_unbalance_skeleton()
+bar_skeleton = create_bar_skeleton()
+line_skeleton = create_line_skeleton()
+
 # ===== Base layout ===== #
 layout = html.Div([
     dbc.Row(justify="center", children=[
         dbc.Col([
             html.H2("Real Time Data", className="tabTitle"),
-            dcc.Graph(id="realTimeContourGraph"),
-            dcc.Graph(id="realTimeUnbalanceGraph"),
-            dcc.Graph(id="realTimeBarGraph"),
-            dcc.Graph(id="HistoryLineGraph"),
+            dcc.Graph(id="realTimeContourGraph", figure=contour_skeleton),
+            dcc.Graph(id="realTimeUnbalanceGraph", figure=unbalance_skeleton),
+            dcc.Graph(id="realTimeBarGraph", figure=bar_skeleton),
+            # The latest reading, drawn in the heatmaps by modules/assets/realtime.js
+            dcc.Store(id="realTimeReading"),
+            dcc.Graph(id="HistoryLineGraph", figure=line_skeleton),
+            # Time of the last reading added to the history graph of this viewer
+            dcc.Store(id="historyCursor"),
             dcc.Interval(id="realTimeGraphsInterval", interval=500, n_intervals=0)
         ], width=8, style={"textAlign": "center", "align-content": "center"}),
     ]),
 ])
 
-total = []
-data_time = []
-countour = []
-unbalance = []
-bar = []
-line = []
-
 # ===== Callbacks ===== #
-@app.callback(Output("realTimeContourGraph", "figure"),
+@app.callback(Output("realTimeReading", "data"),
               Output("realTimeUnbalanceGraph", "figure"),
               Output("realTimeBarGraph", "figure"),
-              Output("HistoryLineGraph", "figure"),
-              Input("realTimeGraphsInterval", "n_intervals"))
-def update_real_time_graphs(n: int) -> tuple[go.Figure, ...]:
-    from time import time
-    start_total = time()
-    start = time()
+              Output("HistoryLineGraph", "extendData"),
+              Output("historyCursor", "data"),
+              Input("realTimeGraphsInterval", "n_intervals"),
+              State("historyCursor", "data"))
+def update_real_time_graphs(n: int, cursor: Optional[int]) -> tuple:
     state, data = predictor.get_current_data()
-    data_time.append(time() - start)
 
     if data.shape[0] == 0:
-        return go.Figure(), go.Figure(), go.Figure(), create_line_graph(data)
-
-    start = time()
-    contour_graph = create_contour_graph(data)
-    countour.append(time() - start)
-    start = time()
-    unbalance_graph = create_unbalance_graph(data)
-    unbalance.append(time() - start)
-    start = time()
-    bar_graph = create_bar_graph(data)
-    bar.append(time() - start)
-    start = time()
-    line_graph = create_line_graph(data)
-    line.append(time() - start)
-
-    total.append(time() - start_total)
-
-    if n % 5 == 0:
-        for name, l in zip(
-            ("Data", "Contour", "Unbalance", "Bar", "Line", "Total"),
-            (data_time, countour, unbalance, bar, line, total)
-        ):
-            print(f"{name}: {np.mean(l[-5:])}")
-
-    return contour_graph, unbalance_graph, bar_graph, line_graph
+        # The graphs keep the last reading, the heatmaps are emptied by the browser
+        return None, no_update, no_update, *update_line_graph(data, cursor)
+
+    # The stages and the whole callback are timed by the instrumentation module
+    with instrumentation.timed("figure"):
+        reading = get_reading(data)
+        unbalance_graph = update_unbalance_graph(data)
+        bar_graph = update_bar_graph(data)
+        line_graph, cursor = update_line_graph(data, cursor)
+
+    return reading, unbalance_graph, bar_graph, line_graph, cursor
+
+# The heatmaps are interpolated by the browser, so only the values of the sensors are sent
+app.clientside_callback(ClientsideFunction(namespace="realtime", function_name="contour"),
+                        Output("realTimeContourGraph", "figure"),
+                        Input("realTimeReading", "data"))
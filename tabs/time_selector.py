@@ -4,20 +4,23 @@ import plotly.graph_objects as go
 import plotly.express as px
 import polars as pl
 
-from dash import dcc, html
+from dash import ClientsideFunction, dcc, html
 from dash.dependencies import Input, Output, State
 from datetime import date, datetime, timedelta
 from plotly.subplots import make_subplots
 from typing import Optional
 
-from modules import database_manager
+from modules import database_manager, history_archive, playback, pyramid, z_generator
 from modules.base_app import app, DEBUG_STATE
-from modules.z_generator import points, is_back_point, generate_z
+from modules.z_generator import points, is_back_point, interpolate
 
 # ===== Variables ===== #
 marks = None
-is_processed = False
-data = pl.DataFrame()
+
+# Approximate width of the line plot in pixels, used to choose the resolution of the data
+LINE_PLOT_WIDTH = 1200
+# Shortest time in milliseconds between the frames of the playback
+PLAYBACK_TICK = 100
 
 # ===== Helper functions ===== #
 def date_to_string(date: datetime) -> str:
@@ -62,23 +65,23 @@ def calculate_marks(data: pl.DataFrame) -> dict[int, str]:
         marks[n - index] = date_to_string(dates[n - index])
     return marks
 
-def create_heatmaps_fig(z: tuple[list[list[int]]]) -> go.Figure:
+def create_heatmaps_fig(z: tuple[np.ndarray, np.ndarray]) -> go.Figure:
     """
     Creates a figure with two heatmaps.
 
     Parameters
     ----------
-    z : tuple[list[list[int]]]
-        The data to use.
+    z : tuple[numpy.ndarray, numpy.ndarray]
+        The interpolated grids of the seat and backrest.
     """
     label = dict(font_size=14)
     contours = dict(start=0, end=4608, showlines= False)
     template = "Value: %{z:.2f}<extra></extra>"
 
     fig = make_subplots(rows=1, cols=2, subplot_titles=("Seat", "Backrest"))
-    fig.add_trace(go.Contour(z=z[0], connectgaps=True, contours=contours, hoverlabel=label,
+    fig.add_trace(go.Contour(z=z[0], contours=contours, hoverlabel=label,
                                 colorscale="Blues", hovertemplate=template), row=1, col=1)
-    fig.add_trace(go.Contour(z=z[1], connectgaps=True, contours=contours, hoverlabel=label,
+    fig.add_trace(go.Contour(z=z[1], contours=contours, hoverlabel=label,
                                 colorscale="Blues", hovertemplate=template), row=1, col=2)
 
     fig.update_xaxes(showticklabels=False)
@@ -90,27 +93,33 @@ def create_heatmaps_fig(z: tuple[list[list[int]]]) -> go.Figure:
 
     return fig
 
-def calculate_contour_average_plot() -> go.Figure:
+def calculate_contour_average_plot(data: pl.DataFrame) -> go.Figure:
     """
     Calculates the average of all the data and returns a contour plot.
     Used to make the app.layout more readable.
-    """
-    global data
 
-    # Calculate the average of each sensor
-    z = generate_z(data[:, :-1].mean())
+    Parameters
+    ----------
+    data : polars.DataFrame
+        The data of the selected window.
+    """
+    # The interpolation is linear, so the map of the average is the average of the maps
+    z = interpolate(data[:, :-1].mean())
 
     fig = create_heatmaps_fig(z)
     fig.update_layout(height=700, width=1200, title_text="Average Heatmap")
 
     return fig
 
-def calculate_asymmetry_plot() -> go.Figure:
+def calculate_asymmetry_plot(data: pl.DataFrame) -> go.Figure:
     """
     Quantifies how assymetric the seat and backrest are.
-    """
-    global data
 
+    Parameters
+    ----------
+    data : polars.DataFrame
+        The data of the selected window.
+    """
     # Calculate the average of each sensor
     avg = data.mean()
     asymmetry_data = {
@@ -132,67 +141,44 @@ def calculate_asymmetry_plot() -> go.Figure:
     fig.update_traces(marker_color=color_list)
     return fig
 
-def calculate_time_seated_plot(granularity: int = 10, threshold: int = 500) -> go.Figure:
+def calculate_time_seated_plot(data: pl.DataFrame, levels: dict[int, pl.DataFrame],
+                               granularity: int = 10, threshold: int = 500) -> go.Figure:
     """
     Calculates the time spent sitting on the seat.
 
     Parameters
     ----------
+    data : polars.DataFrame
+        The data of the selected window.
+    levels : dict[int, polars.DataFrame]
+        The aggregates of the selected window.
     granularity : int
         The granularity of the data in seconds.
     threshold : int
         The threshold of the pressure to be considered sitting
     """
-    global data
-
-    times = data["index"]
-    time_start = times[0]
-    time_end = times[-1]
-
-    intervals_classified = []
-
-    interval_start = time_start
-    last_data_idx = 0
-    # Pass through all intervals
-    while interval_start < time_end:
-        interval_class = None
-        interval_data = []
-
-        # Pass through all data points
-        while times[last_data_idx] < (interval_start + timedelta(seconds=granularity)):
-            interval_data.append(data[last_data_idx].mean(axis=1)[0])
-            last_data_idx += 1
-            if last_data_idx >= len(data):
-                break
-
-        # If there is no data in the interval
-        if len(interval_data) == 0:
-            interval_class = "No data"
-        else:
-            # Classify the interval based on the average pressure
-            interval_mean = np.mean(interval_data)
-            if interval_mean > threshold:
-                interval_class = "Sitting"
-            else:
-                interval_class = "Not sitting"
-
-        # Join the intervals if they are the same
-        if len(intervals_classified) > 0 and intervals_classified[-1]["class"] == interval_class:
-            # Update the end of the interval
-            intervals_classified[-1]["end"] = interval_start + timedelta(seconds=granularity)
-
-        # If the interval is different, add it to the list
-        else:
-            intervals_classified.append({
-                "class": interval_class,
-                "start": interval_start,
-                "end": interval_start + timedelta(seconds=granularity)
-            })
-
-        # Move to the next interval
-        interval_start += timedelta(seconds=granularity)
-
-    intervals_classified = pl.DataFrame(intervals_classified)
+    # Use the coarsest aggregates that fit in the intervals
+    source = pyramid.select(levels, data, pyramid.level_for_granularity(granularity))
+    intervals = pyramid.aggregate(source, granularity).select(
+        "index", pl.mean_horizontal([f"{sensor}_mean" for sensor in pyramid.SENSORS]).alias("mean")
+    )
+
+    # Intervals without data don't have a bucket, so they're added to the full range
+    every = timedelta(seconds=granularity)
+    times = pl.datetime_range(intervals[0, "index"], intervals[-1, "index"], every,
+                              time_unit="ms", eager=True).alias("index")
+    intervals = times.to_frame().join(intervals, on="index", how="left").with_columns(
+        pl.when(pl.col("mean").is_null()).then(pl.lit("No data"))
+        .when(pl.col("mean") > threshold).then(pl.lit("Sitting"))
+        .otherwise(pl.lit("Not sitting")).alias("class")
+    )
+
+    # Join the consecutive intervals that are the same
+    intervals_classified = intervals.group_by(pl.col("class").rle_id().alias("run"), maintain_order=True).agg(
+        pl.col("class").first(),
+        pl.col("index").first().alias("start"),
+        (pl.col("index").last() + every).alias("end"),
+    )
 
     # Create a horizontal bar chart where the x axis is the time and the y axis is the classification
     fig = px.timeline(x_start=intervals_classified["start"],
@@ -210,48 +196,69 @@ def calculate_time_seated_plot(granularity: int = 10, threshold: int = 500) -> g
                     )
     return fig
 
-def calculate_line_plot() -> go.Figure:
+def add_gap_zeros(lines: pl.DataFrame, max_gap: timedelta) -> pl.DataFrame:
     """
-    Calculates the line plot of the pressure over time.
+    Adds points with 0 values around the sudden jumps in time whose values are not 0,
+    to make the line plot more readable and continuous.
+
+    Parameters
+    ----------
+    lines : polars.DataFrame
+        The data of the lines, sorted by "index".
+    max_gap : datetime.timedelta
+        The largest time between points that isn't a jump.
+
+    Returns
+    -------
+    polars.DataFrame
+    """
+    times = lines["index"].to_numpy()
+    # Indices of the points after each jump
+    after = np.flatnonzero(np.diff(times) > np.timedelta64(max_gap)) + 1
+    before = after - 1
+    if len(after) == 0:
+        return lines
+
+    row_max = lines.drop("index").max_horizontal().to_numpy()
+    epsilon = np.timedelta64(1, "ms")
+    extension = np.concatenate([
+        times[before[row_max[before] > 0]] + epsilon,
+        times[after[row_max[after] > 0]] - epsilon,
+    ])
+    if len(extension) == 0:
+        return lines
+
+    zeros = pl.DataFrame({"index": extension}).select(
+        [pl.lit(0).cast(dtype).alias(col) if col != "index" else pl.col("index").cast(dtype)
+         for col, dtype in lines.schema.items()]
+    )
+    return pl.concat([lines, zeros]).sort("index")
+
+def calculate_line_plot(data: pl.DataFrame, levels: dict[int, pl.DataFrame],
+                        width: int = LINE_PLOT_WIDTH) -> go.Figure:
     """
-    global data
-    global is_processed
-
-    if not is_processed:
-        times = data["index"]
-        seconds = timedelta(seconds=30)
-        # Find the indices of sudden jumps in time
-        temp = np.abs(times[:-1] - times[1:]) > seconds
-        bad = temp.arg_true() + 1
-
-        # If there are sudden jumps in time and the values are not 0,
-        # then add a new data point with 0 values to make the line plot
-        # more readable and continuous
-        if len(bad) > 0:
-            is_processed = True
-            epsilon = timedelta(milliseconds=1)
-            extension = []
-
-            for idx in bad:
-                # Append the new time points to the list
-                if data[idx - 1].max(axis=1)[0] > 0:
-                    extension.append(times[idx - 1] + epsilon)
-                if data[idx].max(axis=1)[0] > 0:
-                    extension.append(times[idx] - epsilon)
-
-            if len(extension) > 0:
-                zeros = [[0 for _ in range(13)] for _ in range(len(extension))]
-                for i in range(len(extension)):
-                    zeros[i][12] = extension[i]
-                temp = pl.DataFrame(zeros,
-                    schema={col: dtype for col, dtype in zip(data.columns, data.dtypes)})
-                data.extend(temp)
-                data = data.sort("index")
+    Calculates the line plot of the pressure over time.
 
+    Parameters
+    ----------
+    data : polars.DataFrame
+        The data of the selected window.
+    levels : dict[int, polars.DataFrame]
+        The aggregates of the selected window.
+    width : int
+        The width of the plot in pixels. The coarsest aggregates that still have
+        a point per pixel are plotted instead of all the data.
+    """
+    span = data[-1, "index"] - data[0, "index"]
+    seconds = pyramid.level_for_width(span, width)
+    source = pyramid.select(levels, data, seconds)
+    lines = source.select("index", *[pl.col(f"{sensor}_mean").alias(sensor) for sensor in pyramid.SENSORS])
+    # Consecutive buckets are a bucket apart, so only larger gaps are jumps
+    lines = add_gap_zeros(lines, max(timedelta(seconds=30), timedelta(seconds=seconds or 0)))
 
     fig = go.Figure()
-    for col in data.columns[:-1]:
-        fig.add_scatter(x=data["index"], y=data[col], name=col, mode="lines")
+    for col in lines.columns[1:]:
+        fig.add_scatter(x=lines["index"], y=lines[col], name=col, mode="lines")
     fig.update_layout(title="Pressure over time", xaxis_title="Time",
                       yaxis_title="Pressure", hovermode="x unified")
     return fig
@@ -281,6 +288,8 @@ layout = html.Div([
             html.Div(id="dateSelectText", children="No date selected."),
             html.Button("Download CSV", id="downloadButton", className="btn btn-lg btn-primary"),
             dcc.Download(id="downloadData"),
+            # The selected window of time, the data itself is read from the history archive
+            dcc.Store(id="selectedWindow"),
             html.Br(),
 
             # Fast data visualzization Graphs
@@ -291,24 +300,29 @@ layout = html.Div([
             dcc.Slider(
                 id="frameSlider",
                 min=0,
-                max=len(data) - 1,
+                max=0,
                 step=1,
-                value=len(data) - 1,
+                value=0,
                 marks=None,
             ),
+            html.Div(id="frameTime"),
             html.Div(id="playerControls", children=[
                 html.Button("Play", id="playButton", n_clicks=0, style={"display": "inline-block"},
                             className="btn btn-light"),
                 html.Fieldset([
+                    # Times the speed of the recording
                     html.Label(children="Speed:", style={"display": "inline-block"},
                                className="form-label alignCenter"),
                     dcc.Input(id="playSpeed", type="number", style={"display": "inline-block"},
-                              className="form-control alignCenter", value=1),
+                              className="form-control alignCenter", value=10, min=0),
                 ], style={"display": "inline-block"}),
-                dcc.Interval(id="playInterval", 
-                interval=1000, 
-                n_intervals=0),
+                dcc.Interval(id="playInterval",
+                interval=PLAYBACK_TICK,
+                n_intervals=0,
+                disabled=True),
             ]),
+            # The window being played, see modules/playback.py
+            dcc.Store(id="playbackInfo"),
 
             # Graphs
             dcc.Graph(id="contourGraphFrame"),
@@ -323,27 +337,49 @@ layout = html.Div([
 ])
 
 # ===== Callbacks ===== #
+def load_window(window: dict[str, str]) -> tuple[datetime, datetime]:
+    """
+    Gets the bounds of the window saved in the "selectedWindow" store.
+
+    Parameters
+    ----------
+    window : dict[str, str]
+        The store data, with the start and end in ISO format.
+
+    Returns
+    -------
+    tuple[datetime.datetime, datetime.datetime]
+    """
+    return datetime.fromisoformat(window["start"]), datetime.fromisoformat(window["end"])
+
 @app.callback(Output("dateSelectText", "children"),
+            Output("selectedWindow", "data"),
             Output("timeSeatedGraph", "figure"),
             Output("lineGraph", "figure"),
             State("dateSelector", "date"),
             Input("dateSelectorButton", "n_clicks"),
             prevent_initial_call=True)
-def update_date_text(date: datetime, n_clicks: int) -> tuple[str, go.Figure, go.Figure]:
+def update_date_text(date: Optional[str], n_clicks: int) -> tuple[str, Optional[dict[str, str]], go.Figure, go.Figure]:
     if n_clicks is not None:
-        global data
+        if date is None:
+            return "No date selected.", None, None, None
+
+        start, end = history_archive.day_window(datetime.fromisoformat(date).date())
+        window = {"start": start.isoformat(), "end": end.isoformat()}
+        data = history_archive.get_window(start, end)
+        if data.shape[0] == 0:
+            return "0 rows selected.", window, None, None
 
-        data = database_manager.get_data_from_day(date)
-        if date is not None:
-            return f"{data.shape[0]} rows selected.", calculate_time_seated_plot(), calculate_line_plot()
-        else:
-            return "No date selected.", None, None
+        levels = history_archive.get_levels(start, end)
+        return (f"{data.shape[0]} rows selected.", window,
+                calculate_time_seated_plot(data, levels), calculate_line_plot(data, levels))
 
 @app.callback(Output("downloadData", "data"),
-                Input("downloadButton", "n_clicks"))
-def download_csv(n_clicks: Optional[int]):
-    if n_clicks is not None:
-        global data
+                Input("downloadButton", "n_clicks"),
+                State("selectedWindow", "data"))
+def download_csv(n_clicks: Optional[int], window: Optional[dict[str, str]]):
+    if n_clicks is not None and window is not None:
+        data = history_archive.get_window(*load_window(window))
 
         data.write_csv("data.csv")
         return dcc.send_file("data.csv")
@@ -353,104 +389,66 @@ def download_csv(n_clicks: Optional[int]):
 def update_date_picker(value):
     return value
 
-# # slider text
-# @app.callback(Output("dateDisplay", "children"),
-#                 Input("frameSlider", "value"))
-# def update_date_display(frame_number):
-#     return date_to_string(data[frame_number, "index"])
-
-# # contour plot
-# @app.callback(Output("contourGraphFrame", "figure"),
-#                 Input("frameSlider", "value"))
-# def update_contour_plot(frame_number):
-#     z = generate_z(data[frame_number, :-1])
-
-#     fig = create_heatmaps_fig(z)
-#     fig.update_layout(height=700, width=1200, title_text="Heatmap")
-
-#     return fig
-
-# # play button
-# @app.callback(Output("frameSlider", "value"),
-#                 Input("playButton", "n_clicks"),
-#                 Input("playInterval", "n_intervals"),
-#                 State("frameSlider", "value"),
-#                 State("playSpeed", "value"))
-# def update_slider(n_clicks, _n_intervals, frame_number, speed):
-#     # if speed is None, pause
-#     if speed is None:
-#         return frame_number
-
-#     if n_clicks == 0:
-#         return frame_number
-#     if n_clicks % 2 != 0:  # play
-#         if frame_number == len(data) - 1:  # if it"s the last frame, reset
-#             return 0
-#         return frame_number + 1
-#     return frame_number  # pause
-
-# @app.callback(Output("playButton", "children"),
-#                 Input("playButton", "n_clicks"))
-# def update_play_button(n_clicks):
-#     if n_clicks % 2 == 0:
-#         return "Play"
-#     return "Pause"
-
-# # play interval
-# @app.callback(Output("playInterval", "interval"),
-#                 Input("playSpeed", "value"))
-# def update_play_interval(speed):
-#     if speed == 0:
-#         return 10_000_000
-#     return 1000 / speed
-
-# # select data button
-# @app.callback(Output("dateSelectorButton", "children"),
-#                 Output("frameSlider", "marks"),
-#                 Output("frameSlider", "max"),
-#                 Output("contourGraphFrameAvg", "figure"),
-#                 Output("asymmetryGraph", "figure"),
-#                 Output("timeSeatedGraph", "figure"),
-#                 Output("lineGraph", "figure"),
-#                 Input("dateSelectorButton", "n_clicks"),
-#                 State("datePicker", "date"),
-#                 State("timePickerStart", "value"),
-#                 State("timePickerEnd", "value"))
-# def select_data(n_clicks, date):
-#     global data
-#     global marks
-#     global is_processed
-
-#     if n_clicks == 0:
-#         return ["Select",
-#                 marks,
-#                 len(data) - 1,
-#                 calculate_contour_average_plot(),
-#                 calculate_asymmetry_plot(),
-#                 calculate_time_seated_plot(),
-#                 calculate_line_plot()]
-
-#     data = database_manager.get_data_from_day(date)
-#     is_processed = False
-#     marks = calculate_marks(data)
-
-#     print("data downloaded")
-
-#     if len(data) == 0:
-#         return ["No data selected",
-#                 None,
-#                 0,
-#                 None,
-#                 None,
-#                 None,
-#                 None]
-
-#     print("marks", marks)
-
-#     return [f"{len(data)} frames selected",
-#             marks,
-#             len(data) - 1,
-#             calculate_contour_average_plot(),
-#             calculate_asymmetry_plot(),
-#             calculate_time_seated_plot(),
-#             calculate_line_plot()]
+@app.callback(Output("playbackInfo", "data"),
+            Output("frameSlider", "max"),
+            Output("frameSlider", "marks"),
+            Output("frameSlider", "value"),
+            Output("contourGraphAvg", "figure"),
+            Output("asymmetryGraph", "figure"),
+            Input("selectedWindow", "data"),
+            prevent_initial_call=True)
+def select_playback(window: Optional[dict[str, str]]) -> tuple:
+    if window is None:
+        return None, 0, None, 0, None, None
+    # Read again on each selection, the chunks of the playback are sliced from it
+    data = playback.get_window(*load_window(window), reload=True)
+    if data.shape[0] == 0:
+        return None, 0, None, 0, None, None
+
+    # The frames are drawn by the client on this figure, see modules/assets/playback.js
+    figure = create_heatmaps_fig(tuple(np.zeros(z_generator.grids_base.shape[1:]) for _ in range(2)))
+    figure.update_layout(height=700, width=1200, title_text="Heatmap")
+    intervals = np.diff(data["index"].to_physical().to_numpy())
+    # Readings per second, from the usual interval between them
+    rate = 1000 / max(float(np.median(intervals)), 1.0) if len(intervals) > 0 else 1.0
+    info = {
+        "start": window["start"],
+        "end": window["end"],
+        "count": data.shape[0],
+        "rate": rate,
+        "chunk": playback.CHUNK_SIZE,
+        "url": playback.ROUTE,
+        "tick": PLAYBACK_TICK,
+        "figure": figure.to_plotly_json(),
+    }
+    return (info, data.shape[0] - 1, calculate_marks(data), 0,
+            calculate_contour_average_plot(data), calculate_asymmetry_plot(data))
+
+# The playback runs in the browser, with the frames prefetched from the playback endpoint
+app.clientside_callback(ClientsideFunction(namespace="playback", function_name="toggle"),
+                        Output("playInterval", "disabled"),
+                        Output("playButton", "children"),
+                        Input("playButton", "n_clicks"))
+
+app.clientside_callback(ClientsideFunction(namespace="playback", function_name="interval"),
+                        Output("playInterval", "interval"),
+                        Input("playSpeed", "value"),
+                        Input("playbackInfo", "data"))
+
+app.clientside_callback(ClientsideFunction(namespace="playback", function_name="advance"),
+                        Output("frameSlider", "value", allow_duplicate=True),
+                        Input("playInterval", "n_intervals"),
+                        State("frameSlider", "value"),
+                        State("playbackInfo", "data"),
+                        State("playSpeed", "value"),
+                        State("playInterval", "interval"),
+                        prevent_initial_call=True)
+
+app.clientside_callback(ClientsideFunction(namespace="playback", function_name="render"),
+                        Output("contourGraphFrame", "figure"),
+                        Output("frameTime", "children"),
+                        Input("frameSlider", "value"),
+                        Input("playbackInfo", "data"),
+                        State("playSpeed", "value"),
+                        State("playInterval", "disabled"),
+                        State("playInterval", "interval"))